@@ -1,69 +1,445 @@
-from argparse import ArgumentParser
+import json, sys
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
 from os import mkdir
 from os.path import exists
 from pathlib import Path
+from threading import Lock
+
+from requests import RequestException
 
 from music_tagger import colors as Color
+from music_tagger import network
 from music_tagger.matcher import MatchError
 from music_tagger.music_file import MusicFile
+from music_tagger.output import error, log, to_console, warn
 from music_tagger.matcher import Matcher
 from music_tagger.util import AUDIO_FORMATS, FOLDER
+from music_tagger.walker import Progress, walk
+from music_tagger.library import TagResult, tag_library, tag_library_async
 
 file_count = 0
 identified_files = 0
+__COUNT_LOCK = Lock()
 
 def main():
     if not exists(FOLDER): mkdir(FOLDER)
+    to_console()
+
+    commands = {
+        "serve": serve,
+        "watch": watch,
+        "musicbrainz": import_musicbrainz,
+        "enqueue": enqueue,
+        "worker": worker,
+        "report": report,
+        "inventory": inventory,
+        "evaluate": evaluate,
+    }
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        return commands[sys.argv[1]](sys.argv[2:])
+
+    parser = create_parser()
+    args = parser.parse_args()
+    configure(args)
+    path = Path(args.file)
 
-    parser = ArgumentParser()
+    find_and_tag(path, args)
+
+    print(f"\n{Color.BOLD}{Color.OKGREEN}Finished!{Color.ENDC}", end='')
+    print(f" - Identified {identified_files}/{file_count} files.")
+
+def create_parser(prog: str = None, file: bool = True) -> ArgumentParser:
+    parser = ArgumentParser(prog)
 
     # Add url
-    parser.add_argument("file", type = str, help = "Path to the file to be analyzed.")
+    if file: parser.add_argument("file", type = str, help = "Path to the file to be analyzed.")
 
     # Add options
     # parser.add_argument("-sc", "--soundcloud", help = "Specify a SoundCloud URL to get metadata from")
     # parser.add_argument("-s", "--spotify", help = "Specify a Spotify URL to get metadata from")
-    parser.add_argument("-f", "--format", default = None, help = "Converts audio files to the desired format")
+    parser.add_argument("-f", "--format", default = None, help = "Converts audio files to the desired formats, e.g. mp3 or mp3,flac")
     parser.add_argument("--no_overwrite", action = "store_true", help = "Keeps existing files and metadata")
     parser.add_argument("-sim", "--simulate", action = "store_true", help = "Simulates the matching without writing metadata or converting files")
     parser.add_argument("--suppress", action = "store_true", help = "Will match with the best option without prompting user")
+    parser.add_argument("--no_shazam", action = "store_true", help = "Matches by filename and tags only, without audio recognition")
+    parser.add_argument("--two_pass", action = "store_true", help = "Tags files that can be matched by name first, then runs Shazam on the rest")
+    parser.add_argument("--workers", type = int, default = 8, help = "Files matched at the same time")
+    parser.add_argument("--shazam_workers", type = int, default = 2, help = "Files recognized with Shazam at the same time")
+    parser.add_argument("--include", action = "append", default = [], metavar = "GLOB", help = "Only tags files matching the pattern, can be repeated")
+    parser.add_argument("--exclude", action = "append", default = [], metavar = "GLOB", help = "Skips files and folders matching the pattern, can be repeated")
+    parser.add_argument("--missing", type = parse_fields, default = None, metavar = "FIELDS", help = "Only tags files an inventory says are missing any of the fields, e.g. isrc,artwork,bpm")
+    parser.add_argument("--offline", action = "store_true", help = "Tags from filenames and existing tags only, without any provider or Shazam")
+    parser.add_argument("--refresh", action = "store_true", help = "Re-tags identified files from their stored provider ids, without matching")
+    parser.add_argument("--dedupe", action = "store_true", help = "Identifies each distinct recording only once and copies the match to its duplicates")
+    parser.add_argument("--deadline", type = float, default = 30, help = "Seconds to wait for online providers per file before using the results so far")
+    parser.add_argument("--timeout", type = parse_timeout, default = (5, 30), metavar = "[CONNECT,]READ", help = "Seconds to wait for a provider to connect and to answer")
+    parser.add_argument("--analysis", default = "fallback", choices = ["fallback", "replace", "off"], help = "Estimates BPM and key locally when the match has none, or always")
+    return parser
 
-    args = parser.parse_args()
-    path = Path(args.file)
+def configure(args):
+    """Applies the options that hold for the whole process"""
+    from music_tagger.enrichment import check_analysis
+    network.SESSION.timeout = args.timeout
+    args.analysis = check_analysis(args.analysis)
+    Matcher.set_shazam_workers(args.shazam_workers)
 
-    find_and_tag(path, args)
+def parse_timeout(value: str) -> tuple[float, float]:
+    values = [float(part) for part in value.split(",")]
+    if len(values) == 1: return min(5, values[0]), values[0]
+    return tuple(values[:2])
 
-    print(f"\n{Color.BOLD}{Color.OKGREEN}Finished!{Color.ENDC}", end='')
-    print(f" - Identified {identified_files}/{file_count} files.")
+def serve(argv: list[str]):
+    from music_tagger.serve import JobServer, create_server
+
+    parser = create_parser("music-tagger serve", file = False)
+    parser.add_argument("--host", default = "127.0.0.1", help = "Address to listen on")
+    parser.add_argument("--port", type = int, default = 8765, help = "Port to listen on")
+    parser.add_argument("--socket", default = None, help = "Listens on a Unix socket instead of a port")
+    args = parser.parse_args(argv)
+    configure(args)
+
+    server = create_server(JobServer(args, args.workers), args.host, args.port, args.socket)
+    print(f"Serving on {args.socket or f'http://{args.host}:{args.port}'}")
+    try: server.serve_forever()
+    except KeyboardInterrupt: print(f"\n{Color.BOLD}{Color.OKGREEN}Stopped!{Color.ENDC}")
+    finally: server.server_close()
+
+def watch(argv: list[str]):
+    from music_tagger.watch import Watcher
+    from music_tagger.soundcloud import SoundCloudAPI
+    from music_tagger.spotify import SpotifyAPI
+
+    parser = create_parser("music-tagger watch")
+    parser.add_argument("--debounce", type = float, default = 0.5, help = "Seconds a new file must stay unchanged before it is tagged")
+    parser.add_argument("--poll", action = "store_true", help = "Polls the folder instead of using inotify")
+    args = parser.parse_args(argv)
+    configure(args)
+    args.suppress = True
+
+    # Warm up tokens once, they are kept for the lifetime of the process
+    try:
+        SpotifyAPI.get_access_token()
+        SoundCloudAPI.get_client_id()
+    except Exception as e:
+        print(f"{Color.WARNING}{Color.BOLD}WARNING:{Color.ENDC} {e}")
+
+    watcher = Watcher(Path(args.file), debounce = args.debounce, poll = args.poll)
+    print(f"Watching {args.file}", "(inotify)" if watcher.is_native() else "(polling)")
+    try:
+        for path in watcher:
+            try: file = count(tag_music(path, args))
+            except Exception as e:
+                print(f"{Color.FAIL}{Color.BOLD}ERROR:{Color.ENDC} {e}")
+                continue
+            if file: watcher.mark_done(file.path)
+    except KeyboardInterrupt:
+        print(f"\n{Color.BOLD}{Color.OKGREEN}Stopped!{Color.ENDC}", end='')
+        print(f" - Identified {identified_files}/{file_count} files.")
+
+def import_musicbrainz(argv: list[str]):
+    from music_tagger.musicbrainz import MusicBrainzAPI
+
+    parser = ArgumentParser("music-tagger musicbrainz")
+    parser.add_argument("dump", type = str, help = "MusicBrainz JSON dump (recording.tar.xz), or recordings as JSON lines")
+    args = parser.parse_args(argv)
+
+    MusicBrainzAPI.import_dump(Path(args.dump))
+
+def enqueue(argv: list[str]):
+    from music_tagger.workqueue import WorkQueue
+
+    parser = ArgumentParser("music-tagger enqueue")
+    parser.add_argument("queue", type = str, help = "Queue file, on a filesystem shared by the workers")
+    parser.add_argument("file", type = str, help = "File or folder to queue")
+    parser.add_argument("--include", action = "append", default = [], metavar = "GLOB", help = "Only queues files matching the pattern, can be repeated")
+    parser.add_argument("--exclude", action = "append", default = [], metavar = "GLOB", help = "Skips files and folders matching the pattern, can be repeated")
+    args = parser.parse_args(argv)
+
+    added = WorkQueue(Path(args.queue)).enqueue(path.resolve() for path in walk(Path(args.file), args.include, args.exclude))
+    print(f"Queued {added} files.")
+
+def worker(argv: list[str]):
+    from music_tagger.workqueue import run_workers
+
+    parser = create_parser("music-tagger worker", file = False)
+    parser.add_argument("queue", type = str, help = "Queue file made by music-tagger enqueue")
+    parser.add_argument("--processes", type = int, default = 1, help = "Worker processes to run on this host")
+    parser.add_argument("--lease", type = float, default = 300, help = "Seconds before a file claimed by a crashed worker is given to another")
+    args = parser.parse_args(argv)
+    configure(args)
+    args.suppress = True
+
+    try: run_workers(Path(args.queue), args, args.processes, args.lease)
+    except KeyboardInterrupt: print(f"\n{Color.BOLD}{Color.OKGREEN}Stopped!{Color.ENDC}")
+
+def report(argv: list[str]):
+    from music_tagger.workqueue import WorkQueue, print_report
+
+    parser = ArgumentParser("music-tagger report")
+    parser.add_argument("queue", type = str, help = "Queue file made by music-tagger enqueue")
+    parser.add_argument("--json", action = "store_true", help = "Prints the report as JSON")
+    args = parser.parse_args(argv)
+
+    result = WorkQueue(Path(args.queue)).report()
+    if args.json: print(json.dumps(result, indent = 4))
+    else: print_report(result)
+
+def inventory(argv: list[str]):
+    from music_tagger.inventory import FIELDS, Inventory
+
+    parser = ArgumentParser("music-tagger inventory")
+    parser.add_argument("file", type = str, help = "Folder to take inventory of")
+    parser.add_argument("--missing", type = parse_fields, default = None, metavar = "FIELDS", help = f"Lists the files missing any of the fields: {', '.join(FIELDS)}")
+    parser.add_argument("--no_update", action = "store_true", help = "Queries the last snapshot without rescanning changed files")
+    parser.add_argument("--workers", type = int, default = None, help = "Processes reading tags")
+    parser.add_argument("--include", action = "append", default = [], metavar = "GLOB", help = "Only includes files matching the pattern, can be repeated")
+    parser.add_argument("--exclude", action = "append", default = [], metavar = "GLOB", help = "Skips files and folders matching the pattern, can be repeated")
+    args = parser.parse_args(argv)
+
+    snapshot = Inventory.load()
+    if not args.no_update:
+        scanned, total = snapshot.update(Path(args.file), args.include, args.exclude, args.workers)
+        snapshot.save()
+        print(f"Scanned {scanned} new or changed files, {total} in total.")
+
+    if args.missing:
+        for path in snapshot.missing(args.missing, Path(args.file)): print(path)
+        return
+    for field in FIELDS:
+        print(f"    {field:12} {len(snapshot.missing([field], Path(args.file)))} missing")
+
+def evaluate(argv: list[str]):
+    from music_tagger import evaluation
+
+    parser = ArgumentParser("music-tagger evaluate")
+    parser.add_argument("corpus", type = str, help = "Labeled files as JSON lines: filename, tags, duration and the expected isrc, url or artist and title")
+    parser.add_argument("recording", type = str, help = "Recorded provider and Shazam responses")
+    parser.add_argument("--record", action = "store_true", help = "Records the responses from the real providers first, needs the corpus files for Shazam")
+    parser.add_argument("--thresholds", type = float, nargs = "+", default = [0.7, 0.8, 0.9], help = "Match ratios to accept")
+    parser.add_argument("--tolerances", type = float, nargs = "+", default = [1, 2], help = "Seconds the duration may be off by")
+    parser.add_argument("--album_types", type = lambda value: value.split(","), nargs = "+", default = [["Single"], ["Single", "Album"]], help = "Release types to accept, e.g. Single Single,Album")
+    parser.add_argument("--stages", nargs = "+", choices = list(evaluation.STAGES), default = list(evaluation.STAGES), help = "Stages to compare")
+    parser.add_argument("--no_latency", action = "store_true", help = "Replays responses instantly instead of with their recorded latency")
+    parser.add_argument("--json", action = "store_true", help = "Prints the results as JSON")
+    args = parser.parse_args(argv)
+
+    corpus = evaluation.load_corpus(Path(args.corpus))
+    if args.record:
+        print(f"Recording {len(corpus)} files...")
+        # At the strictest settings, which make every request the others make
+        evaluation.record(corpus, Path(args.recording), args.stages, max(args.thresholds), min(args.tolerances))
+    with open(args.recording) as file:
+        recording = json.load(file)
+
+    configurations = evaluation.grid(args.thresholds, args.tolerances, args.album_types, args.stages)
+    results = evaluation.evaluate(corpus, recording, configurations, latency = not args.no_latency)
+    if args.json: print(json.dumps(results, indent = 4))
+    else: evaluation.print_results(results)
+
+def parse_fields(value: str) -> list[str]:
+    from music_tagger.inventory import FIELDS
+    fields = [field.strip() for field in value.split(",") if field.strip()]
+    for field in fields:
+        if field not in FIELDS: raise ArgumentTypeError(f"unknown field {field}, choose from {', '.join(FIELDS)}")
+    return fields
 
 def find_and_tag(path: Path, args):
-    if path.is_file(): return tag_music(path, args)
-    for file in path.iterdir():
-        find_and_tag(file, args)
+    if args.offline: return offline(list(walk(path, args.include, args.exclude)), args)
+    if args.missing: return tag_missing(path, args)
+    if args.refresh: return refresh(list(walk(path, args.include, args.exclude)), args)
+    if path.is_file(): return count(tag_music(path, args))
+    files = walk(path, args.include, args.exclude)
+    if args.dedupe: return tag_clusters(list(files), args)
+    if args.two_pass: return tag_in_two_passes(files, args)
+
+    progress = Progress(path, args.include, args.exclude)
+    for chunk in chunks(files, 50):
+        # Files carrying an ISRC or provider id are looked up together, before any fuzzy matching
+        files, matches = resolve(chunk)
+        analyze(list(files), args)
+        for path in chunk:
+            progress.step()
+            count(tag_music(path, args, matches.get(path), files.get(path)))
+        forget_analysis(list(files), args)
+
+def chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) < size: continue
+        yield chunk
+        chunk = []
+    if chunk: yield chunk
+
+def resolve(paths: list[Path]) -> tuple[dict, dict]:
+    """Reads the files and looks them up by their ids together, returns the files and the matches by path"""
+    files = {}
+    for path in paths:
+        if path.suffix.lower() not in AUDIO_FORMATS: continue
+        try: files[path] = MusicFile(path)
+        except Exception: continue
+    try: return files, Matcher.resolve(list(files.values()))
+    except Exception as e:
+        print(f"{Color.WARNING}{Color.BOLD}WARNING:{Color.ENDC} {e}")
+        return files, {}
+
+def analyze(paths: list[Path], args):
+    """Starts the local analysis of the files in a process pool while they're matched.
+    Enrichment waits for it when a match has no BPM and key, or always when replacing."""
+    if args.analysis == "off" or args.simulate or not paths: return
+    from music_tagger.analysis import analyze_all
+    analyze_all(paths)
+
+def forget_analysis(paths: list[Path], args):
+    """Drops the analyses of files that weren't tagged after all"""
+    if args.analysis == "off" or args.simulate or not paths: return
+    from music_tagger.analysis import cancel
+    cancel(paths)
+
+def offline(paths: list[Path], args):
+    from music_tagger.offline import tag_offline
+    global file_count, identified_files
+
+    totals = tag_offline(paths, args.no_overwrite, args.simulate)
+    file_count += len(paths)
+    identified_files += totals["tagged"] + totals["unchanged"]
+    print(f"Tagged {totals['tagged']} files, {totals['unchanged']} were up to date, {totals['failed']} failed.")
+
+def refresh(paths: list[Path], args):
+    """Re-tags files identified before from their stored ids, fetching the current metadata in bulk instead of matching"""
+    from music_tagger.metadata import read_metadata
+    from music_tagger.musicbrainz import MusicBrainzAPI
+    from music_tagger.soundcloud import SoundCloudAPI
+    from music_tagger.spotify import SpotifyAPI
+    apis = {api.NAME: api for api in [SpotifyAPI, SoundCloudAPI, MusicBrainzAPI]}
+
+    ids = {} # provider -> id -> paths
+    for path in paths:
+        tags = read_metadata(path) or {}
+        provider, id = tags.get("provider"), tags.get("provider_id")
+        if provider in apis and id: ids.setdefault(provider, {}).setdefault(id, []).append(path)
+        else: print(f"{Color.WARNING}{Color.BOLD}NOT REFRESHED:{Color.ENDC} {path.name} has no {'known ' if provider else ''}provider id")
+
+    for provider, paths_by_id in ids.items():
+        print(f"Fetching {len(paths_by_id)} tracks from {provider}...")
+        try: tracks = {track.get_id(): track for track in network.breaker(provider).call(apis[provider].get_tracks, list(paths_by_id))}
+        except (RequestException, network.CircuitOpenError) as e:
+            print(f"{Color.WARNING}{Color.BOLD}NOT REFRESHED:{Color.ENDC} {provider}: {e}")
+            continue
+        for chunk in chunks(paths_by_id.items(), 50):
+            refreshed = [path for id, paths in chunk if id in tracks for path in paths]
+            analyze(refreshed, args)
+            for id, paths in chunk:
+                for path in paths:
+                    if id in tracks: count(tag_music(path, args, (tracks[id], 1.0)))
+                    else: print(f"{Color.WARNING}{Color.BOLD}NOT REFRESHED:{Color.ENDC} {path.name} is no longer on {provider}")
+            forget_analysis(refreshed, args)
 
-def tag_music(path: Path, args):
-    if path.suffix not in AUDIO_FORMATS:
-        print(path.name, "is not a supported filetype.\n")
+def tag_missing(path: Path, args):
+    """Tags the files an inventory snapshot says are missing fields, updating the snapshot first"""
+    from music_tagger.inventory import Inventory
+
+    snapshot = Inventory.load()
+    snapshot.update(path, args.include, args.exclude)
+    snapshot.save()
+    paths = [Path(path) for path in snapshot.missing(args.missing, path)]
+    print(f"{len(paths)} files are missing {', '.join(args.missing)}.")
+
+    args = Namespace(**{**vars(args), "missing": None})
+    if args.refresh: return refresh(paths, args)
+    for path in paths: count(tag_music(path, args))
+
+def tag_clusters(paths: list[Path], args):
+    try: from music_tagger.fingerprint import cluster
+    except ImportError as e:
+        warn(f"{Color.WARNING}{Color.BOLD}WARNING:{Color.ENDC} Can't find duplicates without numpy ({e}), tagging each file on its own.")
+        for path in paths: count(tag_music(path, args))
         return
-    file = MusicFile(path)
-    print(f"\n{Color.BOLD}{file}{Color.ENDC}")
+    print(f"Fingerprinting {len(paths)} files...")
+    clusters = cluster(paths)
+    print(f"Found {len(paths) - len(clusters)} duplicates.")
+
+    for chunk in chunks(clusters, 50):
+        members = [path for duplicates in chunk for path in duplicates]
+        analyze(members, args)
+        for duplicates in chunk:
+            match = None
+            for path in duplicates:
+                # An extended mix can sound the same as its radio edit, but isn't as long
+                file = count(tag_music(path, args, match if match and same_duration(path, match[0]) else None))
+                if not match and file and file.identity: match = file.identity, file.ratio
+        forget_analysis(members, args)
+
+def same_duration(path: Path, track) -> bool:
+    try: return abs((track.get_duration() or 0) - MusicFile(path).get_duration()) <= Matcher.DURATION_TOLERANCE
+    except Exception: return False
+
+def tag_in_two_passes(paths, args):
+    """Tags what cheap text searches can resolve first, then adds Shazam to the candidates of the rest only"""
+    from concurrent.futures import ThreadPoolExecutor
+    args.suppress = True
+
+    print(f"{Color.BOLD}Pass 1:{Color.ENDC} Matching by name...")
+    first = Namespace(**{**vars(args), "no_shazam": True, "confident": True})
+    files = []
+    with ThreadPoolExecutor(args.workers) as executor:
+        # Unresolved files keep their analysis for the second pass
+        for chunk in chunks(paths, 50):
+            analyze(chunk, args)
+            files += [file for file in executor.map(lambda path: tag_music(path, first), chunk) if file]
+    unresolved = [file for file in files if not file.identity and not args.no_shazam]
+    for file in files:
+        if file not in unresolved: count(file)
+
+    if unresolved:
+        # The text searches aren't repeated, their results are kept with the files
+        print(f"\n{Color.BOLD}Pass 2:{Color.ENDC} Matching {len(unresolved)} unresolved files with Shazam...")
+        second = Namespace(**{**vars(args), "shazam_only": True})
+        with ThreadPoolExecutor(args.shazam_workers) as executor:
+            for file in executor.map(lambda file: tag_music(file.path, second, file = file), unresolved): count(file)
+    forget_analysis([file.path for file in files if not file.identity], args)
+
+def count(file: MusicFile | None) -> MusicFile | None:
+    """Counts a tagged file for the summary, from any thread"""
     global file_count, identified_files
-    
-    file_count += 1
+    if not file: return file
+    with __COUNT_LOCK:
+        file_count += 1
+        if file.identity: identified_files += 1
+    return file
+
+def tag_music(path: Path, args, match: tuple = None, file: MusicFile = None) -> MusicFile | None:
+    """Tags a file, or uses the given match of a duplicate.
+    file is the file read by a batch lookup of ids already, which isn't repeated for it"""
+    if path.suffix.lower() not in AUDIO_FORMATS:
+        warn(path.name, "is not a supported filetype.\n")
+        return
+    resolved = file is not None
+    file = file or MusicFile(path)
+    log(f"\n{Color.BOLD}{file}{Color.ENDC}")
+    # Only Shazam is added to the candidates found before
+    shazam_only = getattr(args, "shazam_only", False)
+    file.error = None
 
     try: 
-        Matcher.print_match(*file.identify(suppress = args.suppress))
-        identified_files += 1
+        if match:
+            log("Using a known match.")
+            file.identity, file.ratio = match
+        else: match = file.identify(suppress = args.suppress, shazam = not args.no_shazam, confident = getattr(args, "confident", False), deadline = args.deadline, ids = not resolved, apis = [] if shazam_only else None)
+        Matcher.print_match(*match)
     except MatchError as e:
-        print(f"{Color.WARNING}{Color.BOLD}NO MATCH:{Color.ENDC} {e}")
+        warn(f"{Color.WARNING}{Color.BOLD}NO MATCH:{Color.ENDC} {e}")
+        file.error = str(e)
     except Exception as e:
-        print(f"{Color.FAIL}{Color.BOLD}ERROR:{Color.ENDC} {e}")
-
-    if args.simulate: return
+        error(f"{Color.FAIL}{Color.BOLD}ERROR:{Color.ENDC} {e}")
+        file.error = str(e)
 
-    if args.format:
-        format = args.format if args.format.startswith('.') else f".{args.format}"
-        if file.get_ext() != format:
-            file.convert(format, args.no_overwrite)
+    if args.simulate or not file.identity and getattr(args, "confident", False): return file
+    file.enrich(args.analysis)
 
-    file.write_metadata(args.no_overwrite)
+    formats = [format if format.startswith('.') else f".{format}" for format in args.format.split(",")] if args.format else []
+    if not formats or file.get_ext() in formats:
+        file.write_metadata(args.no_overwrite, args.analysis)
+    if formats:
+        file.convert(formats, args.no_overwrite, args.analysis, keep = file.get_ext() in formats)
+    return file
@@ -0,0 +1,126 @@
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+
+import mutagen
+import numpy as np
+
+from music_tagger.spotify import SpotifyAudioFeatures
+
+SAMPLE_RATE = 22050
+EXCERPT = 60 # seconds
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+
+__EXECUTOR = None # created when first needed
+__PENDING = {} # path -> future of its analysis
+__LOCK = Lock()
+
+__MIN_BPM = 70
+__MAX_BPM = 180
+
+# Krumhansl-Schmuckler key profiles, starting at C
+__MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+__MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+def decode(filepath: Path, offset: float = 0, duration: float = EXCERPT, rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decodes a mono excerpt of the file with ffmpeg"""
+    output = subprocess.run([
+        "ffmpeg", "-v", "error",
+        "-ss", str(offset), "-t", str(duration),
+        "-i", str(filepath),
+        "-ac", "1", "-ar", str(rate),
+        "-f", "f32le", "pipe:1"
+    ], stdin = subprocess.DEVNULL, capture_output = True, check = True).stdout
+    return np.frombuffer(output, dtype = np.float32)
+
+def excerpt_offset(filepath: Path, duration: float = EXCERPT) -> float:
+    """Centers the excerpt, skipping intros and outros"""
+    length = mutagen.File(filepath).info.length
+    return max(0, (length - duration) / 2)
+
+def spectrogram(samples: np.ndarray) -> np.ndarray:
+    """Magnitude spectrogram with frames along the first axis"""
+    if len(samples) < FRAME_SIZE:
+        samples = np.pad(samples, (0, FRAME_SIZE - len(samples)))
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    return np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE), axis = 1))
+
+def estimate_tempo(spectrum: np.ndarray, rate: int = SAMPLE_RATE) -> float:
+    # Onset strength from positive spectral flux
+    flux = np.diff(np.log1p(100 * spectrum), axis = 0)
+    onsets = np.maximum(flux, 0).sum(axis = 1)
+    onsets -= onsets.mean()
+
+    # Autocorrelation through the FFT
+    n = 2 ** int(np.ceil(np.log2(2 * len(onsets))))
+    power = np.abs(np.fft.rfft(onsets, n)) ** 2
+    autocorrelation = np.fft.irfft(power)[:len(onsets)]
+
+    frame_rate = rate / HOP_SIZE
+    lags = np.arange(len(autocorrelation))
+    valid = (lags >= 60 * frame_rate / __MAX_BPM) & (lags <= 60 * frame_rate / __MIN_BPM)
+    if not valid.any(): return 0
+    lag = lags[valid][np.argmax(autocorrelation[valid])]
+
+    # Parabolic interpolation for sub-frame precision
+    if 0 < lag < len(autocorrelation) - 1:
+        a, b, c = autocorrelation[lag - 1:lag + 2]
+        if a - 2 * b + c != 0: lag += 0.5 * (a - c) / (a - 2 * b + c)
+
+    return 60 * frame_rate / lag
+
+def estimate_key(spectrum: np.ndarray, rate: int = SAMPLE_RATE) -> tuple[int, bool]:
+    """Returns the pitch class and whether the key is major"""
+    frequencies = np.fft.rfftfreq(FRAME_SIZE, 1 / rate)
+    audible = (frequencies >= 55) & (frequencies <= 5000)
+    pitches = np.round(69 + 12 * np.log2(frequencies[audible] / 440)).astype(int) % 12
+
+    # Chromagram summed over time
+    energy = (spectrum[:, audible] ** 2).sum(axis = 0)
+    chroma = np.bincount(pitches, weights = energy, minlength = 12)
+
+    profiles = np.array([np.roll(profile, key) for profile in (__MAJOR_PROFILE, __MINOR_PROFILE) for key in range(12)])
+    correlations = [np.corrcoef(chroma, profile)[0, 1] for profile in profiles]
+    best = int(np.nanargmax(correlations))
+    return best % 12, best < 12
+
+def analyze_samples(samples: np.ndarray, rate: int = SAMPLE_RATE) -> dict:
+    spectrum = spectrogram(samples)
+    key, major = estimate_key(spectrum, rate)
+    return {
+        "tempo": estimate_tempo(spectrum, rate),
+        "key": key,
+        "mode": int(major),
+    }
+
+def analyze(filepath: Path) -> SpotifyAudioFeatures:
+    """Analyzes the file, or waits for its analysis if analyze_all started it"""
+    with __LOCK: pending = __PENDING.pop(Path(filepath), None)
+    return SpotifyAudioFeatures(pending.result() if pending else __analyze_data(filepath))
+
+def analyze_all(filepaths: list[Path]):
+    """Starts analyzing the files in a process pool, ahead of analyze asking for them"""
+    global __EXECUTOR
+    with __LOCK:
+        if __EXECUTOR is None: __EXECUTOR = ProcessPoolExecutor()
+        for filepath in filepaths:
+            if Path(filepath) not in __PENDING: __PENDING[Path(filepath)] = __EXECUTOR.submit(__analyze_data, filepath)
+
+def cancel(filepaths: list[Path]):
+    """Drops the analyses started for files that didn't need them"""
+    with __LOCK:
+        for filepath in filepaths:
+            pending = __PENDING.pop(Path(filepath), None)
+            if pending: pending.cancel()
+
+def __analyze_data(filepath: Path) -> dict:
+    return analyze_samples(decode(filepath, excerpt_offset(filepath)))
+
+if __name__ == "__main__":
+    # Quick tests
+    t = np.arange(SAMPLE_RATE * 20) / SAMPLE_RATE
+    clicks = (np.sin(2 * np.pi * 440 * t) * (t % 0.5 < 0.05)).astype(np.float32) # A, 120 BPM
+    features = SpotifyAudioFeatures(analyze_samples(clicks))
+    print(features.get_tempo(), features.get_musical_key(), features.get_camelot_key())
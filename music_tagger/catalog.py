@@ -0,0 +1,266 @@
+import re, sqlite3, time
+from os.path import join
+from pathlib import Path
+from threading import Lock
+
+from music_tagger import colors as Color
+from music_tagger.memo import cached_only
+from music_tagger.output import warn
+from music_tagger.util import FOLDER, KEYWORDS
+
+class CatalogAPI:
+    """Local SQLite catalog of every track seen so far, queried before going to the network."""
+    NAME = "Catalog"
+    LOCAL = True
+    __DATABASE = Path(join(FOLDER, "catalog.db"))
+    __COLUMNS = [
+        "isrc",
+        "title",
+        "artist",
+        "album",
+        "album_artist",
+        "album_type",
+        "duration",
+        "artwork",
+        "genre",
+        "label",
+        "year",
+        "explicit",
+        "url",
+        "source",
+        "provider_id",
+        "tempo",
+        "musical_key",
+        "camelot_key",
+    ]
+
+    __connection = None
+    __lock = Lock()
+
+    @staticmethod
+    def connect() -> sqlite3.Connection:
+        if CatalogAPI.__connection: return CatalogAPI.__connection
+        CatalogAPI.__DATABASE.parent.mkdir(parents = True, exist_ok = True)
+        connection = sqlite3.connect(CatalogAPI.__DATABASE, check_same_thread = False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(f"""CREATE TABLE IF NOT EXISTS tracks (
+            key TEXT PRIMARY KEY,
+            {", ".join(CatalogAPI.__COLUMNS)},
+            updated REAL)""")
+
+        # Catalogs made by older versions lack the newer columns
+        existing = [row["name"] for row in connection.execute("PRAGMA table_info(tracks)")]
+        for column in CatalogAPI.__COLUMNS:
+            if column not in existing: connection.execute(f"ALTER TABLE tracks ADD COLUMN {column}")
+        create_index(connection, "tracks_index", "SELECT rowid, normalize(COALESCE(artist, '') || ' ' || COALESCE(title, '') || ' ' || COALESCE(album, '')) FROM tracks")
+        CatalogAPI.__connection = connection
+        return connection
+
+    @staticmethod
+    def use(database: Path):
+        """Keeps the catalog in another file from now on"""
+        with CatalogAPI.__lock:
+            CatalogAPI.__DATABASE = Path(database)
+            CatalogAPI.__connection = None
+
+    @staticmethod
+    def search(query: str = "", limit: int = 5) -> list:
+        match = fts_query(query)
+        if not match: return []
+        with CatalogAPI.__lock:
+            rows = CatalogAPI.connect().execute("""
+                SELECT tracks.* FROM (SELECT rowid, search FROM tracks_index WHERE tracks_index MATCH ? LIMIT ?) AS hits
+                JOIN tracks ON tracks.rowid = hits.rowid
+                ORDER BY length(hits.search) LIMIT ?""", (match, CANDIDATES, limit)).fetchall()
+        return [CatalogTrack(row) for row in rows]
+
+    @staticmethod
+    def get(isrc: str):
+        # Tracks with an ISRC are keyed by it
+        with CatalogAPI.__lock:
+            row = CatalogAPI.connect().execute("SELECT * FROM tracks WHERE key = ?", (isrc,)).fetchone()
+        if row: return CatalogTrack(row)
+
+    @staticmethod
+    def get_all(isrcs: list[str]) -> dict:
+        """Tracks by ISRC, in a single query"""
+        if not isrcs: return {}
+        with CatalogAPI.__lock:
+            rows = CatalogAPI.connect().execute(f"SELECT * FROM tracks WHERE key IN ({', '.join('?' * len(isrcs))})", isrcs).fetchall()
+        return {row["key"]: CatalogTrack(row) for row in rows}
+
+    @staticmethod
+    def add(track, features = None):
+        CatalogAPI.add_all([track], features)
+
+    @staticmethod
+    def add_all(tracks: list, features = None):
+        rows = [CatalogAPI.__to_row(track, features) for track in tracks if not isinstance(track, CatalogTrack)]
+        rows = [row for row in rows if row.get("key")]
+        if not rows: return
+
+        columns = ["key"] + CatalogAPI.__COLUMNS + ["updated"]
+        updates = ", ".join(f"{column} = COALESCE(excluded.{column}, {column})" for column in columns[1:])
+        try:
+            with CatalogAPI.__lock, CatalogAPI.connect() as connection:
+                for row in rows:
+                    rowid = connection.execute(f"""
+                        INSERT INTO tracks ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})
+                        ON CONFLICT(key) DO UPDATE SET {updates}
+                        RETURNING rowid""", [row.get(column) for column in columns]).fetchone()[0]
+                    connection.execute("DELETE FROM tracks_index WHERE rowid = ?", (rowid,))
+                    connection.execute("INSERT INTO tracks_index (rowid, search) VALUES (?, ?)",
+                        (rowid, normalize(f"{row.get('artist')} {row.get('title')} {row.get('album')}")))
+        except sqlite3.Error as e:
+            warn(f"{Color.WARNING}{Color.BOLD}CATALOG ERROR:{Color.ENDC} {e}")
+
+    @staticmethod
+    def __to_row(track, features) -> dict:
+        # Only what the track knows already, e.g. a Shazam track doesn't search Spotify just to be saved
+        with cached_only():
+            row = {
+                "isrc": safe_get(track.get_isrc),
+                "title": safe_get(track.get_title),
+                "artist": safe_get(track.get_artist),
+                "album": safe_get(track.get_album),
+                "album_artist": safe_get(lambda: track.get_album_artist() and str(track.get_album_artist())),
+                "album_type": safe_get(track.get_album_type),
+                "duration": safe_get(track.get_duration) or None,
+                "artwork": safe_get(track.get_artwork),
+                "genre": safe_get(track.get_genre),
+                "label": safe_get(track.get_label),
+                "year": safe_get(lambda: int(track.get_year())),
+                "explicit": safe_get(track.is_explicit),
+                "url": safe_get(track.get_url),
+                "source": get_provider(track),
+                "provider_id": safe_get(track.get_id),
+                "updated": time.time(),
+            }
+
+        # Audio features come from the track itself or from local analysis
+        if features:
+            row["tempo"] = safe_get(features.get_tempo)
+            row["musical_key"] = safe_get(features.get_musical_key)
+            row["camelot_key"] = safe_get(features.get_camelot_key)
+
+        row["key"] = row["isrc"] if row["isrc"] else row["url"]
+        return row
+
+class CatalogTrack:
+    def __init__(self, row: sqlite3.Row):
+        self.__row = dict(row)
+
+    def get_title(self) -> str:
+        return self.__row.get("title")
+
+    def get_artist(self) -> str:
+        return self.__row.get("artist")
+
+    def get_album_artist(self) -> str:
+        return self.__row.get("album_artist")
+
+    def get_album(self) -> str:
+        return self.__row.get("album") or ""
+
+    def get_album_type(self) -> str:
+        return self.__row.get("album_type")
+
+    def get_isrc(self) -> str:
+        return self.__row.get("isrc")
+
+    def get_year(self) -> int:
+        return self.__row.get("year")
+
+    def get_artwork(self) -> str:
+        return self.__row.get("artwork")
+
+    def get_duration(self) -> int:
+        return self.__row.get("duration") or 0
+
+    def get_genre(self) -> str | None:
+        return self.__row.get("genre")
+
+    def get_label(self) -> str | None:
+        return self.__row.get("label")
+
+    def is_explicit(self) -> bool | None:
+        if self.__row.get("explicit") is None: return None
+        return bool(self.__row.get("explicit"))
+
+    def get_tempo(self) -> int | None:
+        return self.__row.get("tempo")
+
+    def get_camelot_key(self) -> str | None:
+        return self.__row.get("camelot_key")
+
+    def get_musical_key(self) -> str | None:
+        return self.__row.get("musical_key")
+
+    def get_url(self) -> str:
+        return self.__row.get("url")
+
+    def get_source(self) -> str:
+        return self.__row.get("source")
+
+    def get_id(self) -> str | None:
+        """Id of the track at its source"""
+        return self.__row.get("provider_id")
+
+    def get_spotify_metadata(self): return None
+
+    def to_string(self) -> str:
+        return f"{self.get_artist()} - {self.get_title()} - {self.get_album()}"
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, self.__class__) and self.__row.get("key") == other.__row.get("key")
+
+    def __hash__(self) -> int:
+        return hash(self.__row.get("key"))
+
+    def __repr__(self) -> str:
+        return f"{self.to_string()}: {Color.OKBLUE}{Color.UNDERLINE}{self.get_url()}{Color.ENDC} ({self.get_source()})"
+
+# HELPERS
+# Rows with every word of the query, of which the shortest are returned. Ranking every row with bm25
+# instead counts how often each word occurs in the whole index, which takes far longer than the search.
+CANDIDATES = 200
+
+# Words that say little about which track it is, but are in most titles, e.g. "Extended Mix"
+__NOISE = set(word for category in ["extended", "featuring", "ignore", "version"]
+    for keyword in KEYWORDS.words(category) for word in re.sub(r"[^\w]+", " ", keyword.lower()).split())
+
+def normalize(string: str) -> str:
+    return re.sub(r"[^\w]+", " ", string.lower()).strip()
+
+def fts_query(query: str) -> str | None:
+    """Turns free text into an FTS5 query matching all of its words, except the version and ignore keywords"""
+    words = set(word for word in normalize(query).split() if len(word) >= 3 and word not in __NOISE)
+    if not words: return None
+    return " AND ".join(f"\"{word}\"" for word in words)
+
+def create_index(connection: sqlite3.Connection, name: str, source: str):
+    """Creates a full-text index of words. Trigram indexes of older versions are rebuilt from source,
+    a query of the rowid and search text, since matching every trigram of common words is slow"""
+    existing = connection.execute("SELECT sql FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    if existing and "trigram" not in existing[0]: return
+    if existing: connection.execute(f"DROP TABLE {name}")
+    connection.execute(f"CREATE VIRTUAL TABLE {name} USING fts5(search, tokenize = 'unicode61 remove_diacritics 2')")
+    if not existing: return
+    connection.create_function("normalize", 1, normalize, deterministic = True)
+    with connection: connection.execute(f"INSERT INTO {name} (rowid, search) {source}")
+
+def get_provider(track) -> str:
+    """Name of the provider the track came from"""
+    if isinstance(track, CatalogTrack): return track.get_source()
+    return type(track).__name__.replace("Track", "")
+
+def safe_get(getter):
+    try: return getter()
+    except Exception: return None
+
+if __name__ == "__main__":
+    # Quick tests
+    for result in CatalogAPI.search("Martin Garrix - Scared to be Lonely"):
+        print(result)
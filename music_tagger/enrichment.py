@@ -0,0 +1,120 @@
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+from requests import RequestException
+
+from music_tagger import colors as Color
+from music_tagger import network
+from music_tagger.catalog import CatalogAPI, get_provider, safe_get
+from music_tagger.metadata import fetch_artwork
+from music_tagger.metrics import METRICS
+from music_tagger.output import log, warn
+
+class TrackMetadata(NamedTuple):
+    """Everything written to a file for its match, collected up front so writing needs no network"""
+    album: str | None = None
+    albumartist: str | None = None
+    artist: str | None = None
+    bpm: float | None = None
+    comment: str | None = None
+    explicit: bool | None = None
+    genre: str | None = None
+    isrc: str | None = None
+    key: str | None = None
+    label: str | None = None
+    title: str | None = None
+    year: int | None = None
+    url: str | None = None
+    provider: str | None = None
+    provider_id: str | None = None
+    artwork: bytes | None = None # JPEG, already downloaded
+
+    def get_tags(self) -> dict:
+        """The tags for embed_metadata"""
+        tags = self._asdict()
+        tags.pop("artwork")
+        return tags
+
+__EXECUTOR = ThreadPoolExecutor(16, thread_name_prefix = "enrichment")
+
+def enrich(identity, path: Path, analysis: str = "fallback") -> TrackMetadata:
+    """Runs every remote lookup of a match at the same time, and collects the results in one record"""
+    with METRICS.timer("Enrichment"):
+        # The Spotify cross-reference comes first, the other lookups are made on what it finds
+        match = run("Spotify", identity.get_spotify_metadata) or identity
+        futures = {
+            "features": __EXECUTOR.submit(run, "Audio features", get_audio_features, match, path, analysis),
+            "genre": __EXECUTOR.submit(run, "Genre", match.get_genre),
+            "label": __EXECUTOR.submit(run, "Label", match.get_label),
+            "artwork": __EXECUTOR.submit(run, "Artwork", download, safe_get(match.get_artwork), get_provider(match)),
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+    features = results["features"]
+    CatalogAPI.add(match, features = features)
+    return TrackMetadata(
+        album = safe_get(match.get_album),
+        albumartist = safe_get(lambda: match.get_album_artist() and str(match.get_album_artist())), # a SpotifyArtist on Spotify
+        artist = safe_get(match.get_artist),
+        bpm = safe_get(features.get_tempo) if features else None,
+        comment = safe_get(features.get_camelot_key) if features else None,
+        explicit = safe_get(match.is_explicit),
+        genre = results["genre"],
+        isrc = safe_get(match.get_isrc),
+        key = safe_get(features.get_musical_key) if features else None,
+        label = results["label"],
+        title = safe_get(match.get_title),
+        year = safe_get(match.get_year),
+        url = safe_get(match.get_url),
+        provider = get_provider(match),
+        provider_id = safe_get(match.get_id),
+        artwork = results["artwork"],
+    )
+
+def run(name: str, function, *args):
+    try: return function(*args)
+    except Exception as e:
+        warn(f"{Color.WARNING}{Color.BOLD}{name.upper()} ERROR:{Color.ENDC} {e}")
+        return None
+
+def download(url: str | None, provider: str) -> bytes | None:
+    if not url: return None
+    # Artwork is served from elsewhere than the provider's API, so it fails on its own
+    return network.breaker(f"{provider} artwork").call(fetch_artwork, url)[0]
+
+def get_audio_features(match, path: Path, analysis: str = "fallback"):
+    """Gets tempo and key from the match, or from local analysis if it has none"""
+    if analysis != "replace":
+        try:
+            if match.get_tempo() is not None:
+                if analysis == "fallback": cancel_analysis(path)
+                return match
+        except (RequestException, network.CircuitOpenError): pass
+
+    if analysis not in ["fallback", "replace"]: return None
+    log("Analyzing audio...")
+    try:
+        from music_tagger.analysis import analyze
+        return analyze(path)
+    except Exception as e:
+        warn(f"{Color.WARNING}{Color.BOLD}ANALYSIS ERROR:{Color.ENDC} {e}")
+        return None
+
+def cancel_analysis(path: Path):
+    """The analysis started ahead for the file isn't needed"""
+    try: from music_tagger.analysis import cancel
+    except ImportError: return # nothing was started without numpy
+    cancel([path])
+
+def check_analysis(analysis: str) -> str:
+    """The analysis mode that works here. Local analysis needs numpy and ffmpeg,
+    which are checked once instead of failing for every file"""
+    if analysis == "off": return analysis
+    try: import numpy
+    except ImportError: missing = "numpy (pip3 install .[analysis])"
+    else: missing = None if shutil.which("ffmpeg") else "ffmpeg"
+    if not missing: return analysis
+    warn(f"{Color.WARNING}{Color.BOLD}WARNING:{Color.ENDC} Estimating BPM and key needs {missing}, they only come from online sources.")
+    return "off"
@@ -0,0 +1,213 @@
+import base64, itertools, json, logging, tempfile, time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlencode
+
+import requests
+
+from music_tagger import colors as Color
+from music_tagger import network
+from music_tagger.catalog import CatalogAPI, normalize
+from music_tagger.matcher import MatchError, Matcher
+from music_tagger.metrics import METRICS
+from music_tagger.output import LOGGER
+from music_tagger.spotify import SpotifyArtists
+
+# Stages that can be switched off, by name
+STAGES = {
+    "full": {},
+    "no_shazam": {"shazam": False},
+    "no_ids": {"ids": False},
+    "text_only": {"shazam": False, "ids": False},
+}
+
+class CorpusFile:
+    """Stands in for a MusicFile, with the filename, tags and duration from a labeled corpus entry"""
+    def __init__(self, entry: dict):
+        self.path = Path(entry.get("path") or entry["filename"])
+        self.metadata = entry.get("tags") or None
+        self.expected = entry.get("expected") # None if the file shouldn't match anything
+        self.__filename = Path(entry["filename"]).with_suffix('').name
+        self.__duration = entry.get("duration", 0)
+
+    def get_filename(self) -> str:
+        return self.__filename
+
+    def get_title(self) -> str | None:
+        return (self.metadata or {}).get("title")
+
+    def get_artist(self) -> str | None:
+        return (self.metadata or {}).get("artist")
+
+    def get_album(self) -> str | None:
+        return (self.metadata or {}).get("album")
+
+    def get_isrc(self) -> str | None:
+        isrc = (self.metadata or {}).get("isrc")
+        if isrc: return isrc.strip().upper().replace("-", "")
+
+    def get_provider_id(self) -> tuple[str, str] | None:
+        metadata = self.metadata or {}
+        if metadata.get("provider") and metadata.get("provider_id"): return metadata["provider"], metadata["provider_id"]
+
+    def get_duration(self) -> int:
+        return round(self.__duration)
+
+    def read(self) -> bytes:
+        return self.path.read_bytes()
+
+    def to_string(self) -> str:
+        if self.get_artist() and self.get_title(): return " - ".join(filter(None, [self.get_artist(), self.get_title(), self.get_album()]))
+        return self.get_filename()
+
+    def is_correct(self, match) -> bool:
+        if not self.expected or not match: return False
+        if self.expected.get("isrc") and (match.get_isrc() or "").upper() == self.expected["isrc"].upper(): return True
+        if self.expected.get("url") and match.get_url() == self.expected["url"]: return True
+        return bool(self.expected.get("title")) and normalize(f"{match.get_artist()} {match.get_title()}") == \
+            normalize(f"{self.expected.get('artist', '')} {self.expected['title']}")
+
+class RecordingSession(network.TimeoutSession):
+    """Makes real requests and keeps the responses, to be replayed later"""
+    def __init__(self):
+        super().__init__()
+        self.responses = {}
+
+    def request(self, method: str, url: str, params: dict = None, **kwargs) -> requests.Response:
+        start = time.perf_counter()
+        response = super().request(method, url, params = params, **kwargs)
+        self.responses[get_key(method, url, params)] = {
+            "status": response.status_code,
+            "body": base64.b64encode(response.content).decode(),
+            "elapsed": time.perf_counter() - start,
+        }
+        return response
+
+class ReplaySession(requests.Session):
+    """Answers requests from recorded responses, with their recorded latency unless latency is False.
+    Requests that weren't recorded get a 404."""
+    def __init__(self, responses: dict, latency: bool = True):
+        super().__init__()
+        self.responses = responses
+        self.latency = latency
+
+    def request(self, method: str, url: str, params: dict = None, **kwargs) -> requests.Response:
+        recorded = self.responses.get(get_key(method, url, params), {"status": 404, "body": "", "elapsed": 0})
+        if self.latency: time.sleep(recorded["elapsed"])
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response._content = base64.b64decode(recorded["body"])
+        response.url = url
+        response.reason = ""
+        response.encoding = "utf-8"
+        return response
+
+def get_key(method: str, url: str, params: dict = None) -> str:
+    # SoundCloud's client_id changes between runs
+    params = {name: value for name, value in (params or {}).items() if name != "client_id"}
+    return f"{method.upper()} {url}?{urlencode(sorted(params.items()))}"
+
+def warm_up():
+    """Fetches tokens before counting, so the first configuration isn't charged for them"""
+    from music_tagger.soundcloud import SoundCloudAPI
+    from music_tagger.spotify import SpotifyAPI
+    for get_token in [SpotifyAPI.get_access_token, SoundCloudAPI.get_client_id]:
+        try: get_token()
+        except Exception as e: print(f"{Color.WARNING}{Color.BOLD}WARNING:{Color.ENDC} {e}")
+
+def load_corpus(filepath: Path) -> list[CorpusFile]:
+    """One JSON object per line: filename, tags, duration and the expected match (isrc, url or artist and title)"""
+    with open(filepath) as file:
+        return [CorpusFile(json.loads(line)) for line in file if line.strip()]
+
+def record(corpus: list[CorpusFile], filepath: Path, stages: list[str] = list(STAGES), threshold: float = None, tolerance: float = None):
+    """Runs the corpus once against the real providers and saves every response, Shazam's included.
+    threshold and tolerance should be the strictest to be evaluated, as those fetch the most pages:
+    any other configuration only asks for a part of what they did."""
+    session = RecordingSession()
+    shazam = {}
+    recognize = Matcher.recognize
+    def recording(music_file, stop = None):
+        shazam[music_file.get_filename()] = result = recognize(music_file, stop)
+        return result
+
+    with isolated():
+        network.SESSION, Matcher.recognize = session, staticmethod(recording)
+        # Every stage, as they make different requests
+        warm_up()
+        for stage in stages: run(corpus, threshold or Matcher.THRESHOLD, tolerance or Matcher.DURATION_TOLERANCE, stage = stage)
+    with open(filepath, "w") as file:
+        json.dump({"responses": session.responses, "shazam": shazam}, file)
+
+def evaluate(corpus: list[CorpusFile], recording: dict, configurations: list[dict], latency: bool = True) -> list[dict]:
+    """Runs the corpus against recorded responses once per configuration"""
+    with isolated():
+        network.SESSION = ReplaySession(recording["responses"], latency)
+        Matcher.recognize = staticmethod(lambda music_file, stop = None: recording["shazam"].get(music_file.get_filename()))
+        warm_up()
+
+        results = []
+        for configuration in configurations:
+            print(f"Evaluating {describe(configuration)}...")
+            results.append({**configuration, **run(corpus, **configuration)})
+        return results
+
+@contextmanager
+def isolated():
+    """Puts back the session, Shazam and the matcher settings replaced while evaluating,
+    and keeps what the matcher reports per file out of the console meanwhile"""
+    saved = network.SESSION, Matcher.__dict__["recognize"], Matcher.THRESHOLD, Matcher.DURATION_TOLERANCE
+    level = LOGGER.level
+    LOGGER.setLevel(logging.CRITICAL + 1)
+    try: yield
+    finally:
+        network.SESSION, Matcher.recognize, Matcher.THRESHOLD, Matcher.DURATION_TOLERANCE = saved
+        LOGGER.setLevel(level)
+        network.reset_breakers()
+
+def run(corpus: list[CorpusFile], threshold: float, tolerance: float = 1, album_types: list[str] = ["Single"], stage: str = "full", shazam: bool = True, ids: bool = True) -> dict:
+    """Identifies every file with a fresh catalog, returns precision, recall and cost per file"""
+    options = {**{"shazam": shazam, "ids": ids}, **STAGES.get(stage, {})}
+    Matcher.THRESHOLD, Matcher.DURATION_TOLERANCE = threshold, tolerance
+    # Breakers opened and latencies seen (which decide hedging) in one configuration may not affect the next
+    network.reset_breakers()
+    METRICS.reset()
+    predicted = correct = errors = 0
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as folder:
+        # Nothing learned in one configuration may help the next
+        CatalogAPI.use(Path(folder) / "catalog.db")
+        SpotifyArtists.use(Path(folder) / "artists.db")
+        for file in corpus:
+            try: match, _ = Matcher.identify(file, album_types = album_types, suppress = True, confident = True, **options)
+            except MatchError: match = None
+            except Exception:
+                match = None
+                errors += 1
+            if match: predicted += 1
+            if file.is_correct(match): correct += 1
+
+    count = max(len(corpus), 1)
+    labeled = sum(1 for file in corpus if file.expected)
+    return {
+        "precision": correct / predicted if predicted else 0,
+        "recall": correct / labeled if labeled else 0,
+        "requests": METRICS.get("requests") / count,
+        "shazam": METRICS.get("Shazam") / count,
+        "seconds": (time.perf_counter() - start) / count,
+        "errors": errors,
+    }
+
+def grid(thresholds: list[float], tolerances: list[float], album_types: list[list[str]], stages: list[str]) -> list[dict]:
+    return [{"threshold": threshold, "tolerance": tolerance, "album_types": types, "stage": stage}
+        for threshold, tolerance, types, stage in itertools.product(thresholds, tolerances, album_types, stages)]
+
+def describe(configuration: dict) -> str:
+    return f"threshold {configuration['threshold']}, tolerance {configuration['tolerance']}s, {'/'.join(configuration['album_types'])}, {configuration['stage']}"
+
+def print_results(results: list[dict]):
+    print(f"{Color.BOLD}{'threshold':>9} {'tolerance':>9} {'album types':>14} {'stage':>10} {'precision':>9} {'recall':>7} {'req/file':>8} {'shazam/file':>11} {'s/file':>7} {'errors':>6}{Color.ENDC}")
+    for result in sorted(results, key = lambda result: (-result["recall"], -result["precision"], result["requests"])):
+        print(f"{result['threshold']:>9} {result['tolerance']:>9} {'/'.join(result['album_types']):>14} {result['stage']:>10} "
+            f"{result['precision']:>9.1%} {result['recall']:>7.1%} {result['requests']:>8.2f} {result['shazam']:>11.2f} {result['seconds']:>7.2f} {result['errors']:>6}")
@@ -0,0 +1,156 @@
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+from music_tagger.analysis import decode, excerpt_offset
+from music_tagger.util import FOLDER
+
+SAMPLE_RATE = 11025
+EXCERPT = 30 # seconds
+FRAME_SIZE = 1024
+HOP_SIZE = 256
+
+PERMUTATIONS = 128
+BANDS = 64
+THRESHOLD = 0.2 # Re-encodes of the same recording share 30-50% of their hashes
+
+__PRIME = (1 << 31) - 1
+__NEIGHBORHOOD = 31 # frames and bins around a peak
+__FAN_OUT = 5       # pairs per peak
+__MAX_DELTA = 64    # frames between paired peaks
+
+__random = np.random.default_rng(31)
+__A = __random.integers(1, __PRIME, PERMUTATIONS, dtype = np.uint64)
+__B = __random.integers(0, __PRIME, PERMUTATIONS, dtype = np.uint64)
+
+def peaks(samples: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the time and frequency indices of the spectral peaks"""
+    if len(samples) < FRAME_SIZE:
+        samples = np.pad(samples, (0, FRAME_SIZE - len(samples)))
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    spectrum = np.log1p(np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE), axis = 1)))
+
+    # Separable maximum filter over the neighborhood
+    half = __NEIGHBORHOOD // 2
+    padded = np.pad(spectrum, half, mode = "constant")
+    maximum = np.lib.stride_tricks.sliding_window_view(padded, __NEIGHBORHOOD, axis = 0).max(axis = -1)
+    maximum = np.lib.stride_tricks.sliding_window_view(maximum, __NEIGHBORHOOD, axis = 1).max(axis = -1)
+
+    is_peak = (spectrum == maximum) & (spectrum > spectrum.mean() + spectrum.std())
+    return np.nonzero(is_peak)
+
+def hashes(samples: np.ndarray) -> np.ndarray:
+    """Hashes pairs of nearby peaks, which is invariant to offsets and encoder delay"""
+    times, frequencies = peaks(samples)
+    order = np.argsort(times, kind = "stable")
+    times, frequencies = times[order], frequencies[order] // 4
+
+    pairs = []
+    for step in range(1, __FAN_OUT + 1):
+        delta = times[step:] - times[:-step]
+        valid = (delta > 0) & (delta < __MAX_DELTA)
+        pairs.append((frequencies[:-step][valid] << 16) | (frequencies[step:][valid] << 6) | delta[valid] // 2)
+    if not pairs: return np.array([], dtype = np.uint64)
+    return np.unique(np.concatenate(pairs).astype(np.uint64))
+
+def signature(samples: np.ndarray) -> np.ndarray | None:
+    """MinHash signature of the peak hashes"""
+    values = hashes(samples) % __PRIME
+    if len(values) == 0: return None
+    return ((__A[:, None] * values[None, :] + __B[:, None]) % __PRIME).min(axis = 1).astype(np.uint32)
+
+def fingerprint(filepath: Path) -> np.ndarray | None:
+    samples = decode(filepath, excerpt_offset(filepath, EXCERPT), EXCERPT, SAMPLE_RATE)
+    return signature(samples)
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity"""
+    return float(np.mean(a == b))
+
+class FingerprintIndex:
+    """Locality-sensitive hash index that clusters near-duplicate signatures"""
+    def __init__(self, threshold: float = THRESHOLD, bands: int = BANDS):
+        self.threshold = threshold
+        self.__bands = bands
+        self.__buckets = {}
+        self.__signatures = {}
+        self.__parents = {}
+
+    def add(self, key, signature: np.ndarray):
+        self.__signatures[key] = signature
+        self.__parents[key] = key
+
+        for band, rows in enumerate(signature.reshape(self.__bands, -1)):
+            bucket = self.__buckets.setdefault((band, rows.tobytes()), [])
+            for other in bucket:
+                if self.__find(other) == self.__find(key): continue
+                if similarity(signature, self.__signatures[other]) >= self.threshold:
+                    self.__union(key, other)
+            bucket.append(key)
+
+    def clusters(self) -> list[list]:
+        clusters = {}
+        for key in self.__signatures:
+            clusters.setdefault(self.__find(key), []).append(key)
+        return list(clusters.values())
+
+    def __find(self, key):
+        while self.__parents[key] != key:
+            self.__parents[key] = self.__parents[self.__parents[key]]
+            key = self.__parents[key]
+        return key
+
+    def __union(self, a, b):
+        self.__parents[self.__find(a)] = self.__find(b)
+
+class FingerprintCache:
+    """Stores signatures by path, size and modification time"""
+    __DATABASE = Path(join(FOLDER, "fingerprints.db"))
+
+    def __init__(self, database: Path = None):
+        database = database or FingerprintCache.__DATABASE
+        database.parent.mkdir(parents = True, exist_ok = True)
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(database, check_same_thread = False)
+        self.__connection.execute("""CREATE TABLE IF NOT EXISTS fingerprints (
+            path TEXT PRIMARY KEY, size INTEGER, mtime REAL, signature BLOB)""")
+
+    def get(self, filepath: Path) -> np.ndarray | None:
+        stat = filepath.stat()
+        with self.__lock:
+            row = self.__connection.execute("SELECT signature FROM fingerprints WHERE path = ? AND size = ? AND mtime = ?",
+                (str(filepath), stat.st_size, stat.st_mtime)).fetchone()
+        if row: return np.frombuffer(row[0], dtype = np.uint32)
+
+    def put(self, filepath: Path, signature: np.ndarray):
+        stat = filepath.stat()
+        with self.__lock, self.__connection:
+            self.__connection.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)",
+                (str(filepath), stat.st_size, stat.st_mtime, signature.tobytes()))
+
+def cluster(filepaths: list[Path], workers: int = None, cache: FingerprintCache = None) -> list[list[Path]]:
+    """Groups files holding the same recording, in a process pool"""
+    cache = cache or FingerprintCache()
+    index = FingerprintIndex()
+    signatures = {filepath: cache.get(filepath) for filepath in filepaths}
+    missing = [filepath for filepath, signature in signatures.items() if signature is None]
+
+    with ProcessPoolExecutor(workers) as executor:
+        for filepath, signature in zip(missing, executor.map(__fingerprint, missing, chunksize = 4)):
+            if signature is None: continue
+            cache.put(filepath, signature)
+            signatures[filepath] = signature
+
+    clusters = []
+    for filepath, signature in signatures.items():
+        if signature is None: clusters.append([filepath])
+        else: index.add(filepath, signature)
+    return clusters + index.clusters()
+
+def __fingerprint(filepath: Path) -> np.ndarray | None:
+    try: return fingerprint(filepath)
+    except Exception: return None
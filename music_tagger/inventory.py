@@ -0,0 +1,240 @@
+import json, mmap, os, struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join
+from pathlib import Path
+
+from music_tagger.metadata import read_info
+from music_tagger.util import FOLDER
+from music_tagger.walker import walk
+
+# Column name -> array typecode, "s" columns are UTF-8 strings stored as offsets and data
+COLUMNS = {
+    "path": "s",
+    "mtime": "d",
+    "size": "Q",
+    "duration": "d",
+    "bitrate": "I",
+    "sample_rate": "I",
+    "artwork": "B",
+    "bpm": "d",
+    "title": "s",
+    "artist": "s",
+    "album": "s",
+    "genre": "s",
+    "year": "s",
+    "key": "s",
+    "isrc": "s",
+    "provider": "s",
+    "provider_id": "s",
+    "missing": "H", # one bit per field in FIELDS
+}
+
+# Fields that can be queried for being missing
+FIELDS = ["title", "artist", "album", "genre", "year", "bpm", "key", "isrc", "artwork", "provider_id"]
+
+MAGIC = b"MTINV1\n\0"
+ALIGN = 8
+
+class Inventory:
+    """Columnar snapshot of the tags and stream info of a library.
+
+    Every column is one contiguous array in a single file, which is memory-mapped
+    when loaded, so a filter only touches the columns it reads.
+    """
+    FILE = Path(join(FOLDER, "inventory.bin"))
+
+    def __init__(self, columns: dict, count: int, source = None):
+        self.__columns = columns
+        self.count = count
+        self.__source = source # keeps the mmap alive
+
+    @staticmethod
+    def load(filepath: Path = None) -> "Inventory":
+        filepath = Path(filepath or Inventory.FILE)
+        if not filepath.is_file(): return Inventory({name: empty(typecode) for name, typecode in COLUMNS.items()}, 0)
+
+        with open(filepath, "rb") as file:
+            source = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        header_size = struct.unpack_from("<Q", source, len(MAGIC))[0]
+        if source[:len(MAGIC)] != MAGIC: raise ValueError(f"{filepath.name} is not an inventory")
+        header = json.loads(source[len(MAGIC) + 8:len(MAGIC) + 8 + header_size])
+
+        view = memoryview(source)
+        columns = {}
+        for name, column in header["columns"].items():
+            if name not in COLUMNS: continue
+            if column["type"] == "s":
+                offsets = view[column["offsets"]:column["offsets"] + (header["count"] + 1) * 8].cast("Q")
+                columns[name] = StringColumn(offsets, view[column["data"]:column["data"] + column["length"]])
+            else:
+                size = array(column["type"]).itemsize
+                columns[name] = view[column["offset"]:column["offset"] + header["count"] * size].cast(column["type"])
+
+        # Columns added in later versions
+        for name, typecode in COLUMNS.items():
+            if name not in columns: columns[name] = StringColumn.of([""] * header["count"]) if typecode == "s" else array(typecode, [0]) * header["count"]
+        return Inventory(columns, header["count"], source)
+
+    def column(self, name: str):
+        return self.__columns[name]
+
+    def rows(self):
+        for i in range(self.count):
+            yield {name: column[i] for name, column in self.__columns.items()}
+
+    def missing(self, fields: list[str], under: Path = None) -> list[str]:
+        """Paths of the files missing any of the fields, optionally only those in a folder"""
+        for field in fields:
+            if field not in FIELDS: raise ValueError(f"Unknown field {field}, choose from {', '.join(FIELDS)}")
+
+        mask = sum(1 << FIELDS.index(field) for field in fields)
+        column = self.__columns["missing"]
+        try:
+            import numpy as np
+            indices = np.flatnonzero(np.frombuffer(column, dtype = np.uint16) & mask).tolist()
+        except ImportError:
+            indices = [i for i, value in enumerate(column) if value & mask]
+
+        paths = self.__columns["path"]
+        prefix = str(Path(under).resolve()) + os.sep if under else ""
+        return [path for path in map(paths.__getitem__, indices) if path.startswith(prefix)]
+
+    def update(self, root: Path, include: list[str] = [], exclude: list[str] = [], workers: int = None) -> tuple[int, int]:
+        """Rescans the files in root whose size or modification time changed, returns (scanned, total)"""
+        root = Path(root).resolve()
+        prefix = str(root) + os.sep
+        paths = self.__columns["path"]
+        previous = {paths[i]: i for i in range(self.count)}
+
+        # Rows of other folders are kept as they are
+        rows = [self.__row(i) for i in range(self.count) if not paths[i].startswith(prefix) and paths[i] != str(root)]
+        stale = []
+        for path in walk(root, include, exclude):
+            try: stat = path.stat()
+            except OSError: continue
+            i = previous.get(str(path))
+            if i is not None and self.__columns["mtime"][i] == stat.st_mtime and self.__columns["size"][i] == stat.st_size:
+                rows.append(self.__row(i))
+            else: stale.append((str(path), stat.st_mtime, stat.st_size))
+
+        with ProcessPoolExecutor(workers) as executor:
+            rows.extend(executor.map(scan, stale, chunksize = 64))
+
+        rows.sort(key = lambda row: row["path"])
+        self.__columns = {name: StringColumn.of([row[name] for row in rows]) if typecode == "s" else array(typecode, [row[name] for row in rows])
+            for name, typecode in COLUMNS.items()}
+        self.count = len(rows)
+        self.__source = None
+        return len(stale), sum(1 for row in rows if row["path"].startswith(prefix))
+
+    def save(self, filepath: Path = None):
+        """Writes the snapshot next to the old one, then swaps them"""
+        filepath = Path(filepath or Inventory.FILE)
+        filepath.parent.mkdir(parents = True, exist_ok = True)
+
+        blobs, header = [], {"count": self.count, "columns": {}}
+        for name, typecode in COLUMNS.items():
+            column = self.__columns[name]
+            if typecode == "s":
+                header["columns"][name] = {"type": "s", "length": len(column.data)}
+                blobs += [(name, "offsets", bytes(column.offsets)), (name, "data", bytes(column.data))]
+            else:
+                header["columns"][name] = {"type": typecode}
+                blobs.append((name, "offset", bytes(column)))
+
+        # Offsets depend on the header size, which depends on the offsets
+        position = 0
+        while True:
+            size = len(json.dumps(header).encode())
+            offset = align(len(MAGIC) + 8 + size)
+            if offset == position: break
+            position = offset
+            for name, key, blob in blobs:
+                header["columns"][name][key] = offset
+                offset = align(offset + len(blob))
+
+        encoded = json.dumps(header).encode()
+        temporary = filepath.with_suffix(".tmp")
+        with open(temporary, "wb") as file:
+            file.write(MAGIC + struct.pack("<Q", len(encoded)) + encoded)
+            for name, key, blob in blobs:
+                file.write(b"\0" * (header["columns"][name][key] - file.tell()))
+                file.write(blob)
+        os.replace(temporary, filepath)
+
+    def __row(self, i: int) -> dict:
+        return {name: column[i] for name, column in self.__columns.items()}
+
+class StringColumn:
+    """UTF-8 strings stored back to back, with the offset of each"""
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @staticmethod
+    def of(strings: list[str]) -> "StringColumn":
+        offsets, data = array("Q", [0]), bytearray()
+        for string in strings:
+            data += (string or "").encode()
+            offsets.append(len(data))
+        return StringColumn(offsets, data)
+
+    def __getitem__(self, i: int) -> str:
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+def scan(entry: tuple[str, float, int]) -> dict:
+    path, mtime, size = entry
+    row = {name: "" if typecode == "s" else 0 for name, typecode in COLUMNS.items()}
+    row.update(path = path, mtime = mtime, size = size)
+    try: info = read_info(path)
+    except Exception: info = None
+    if not info:
+        row["missing"] = (1 << len(FIELDS)) - 1
+        return row
+
+    tags = info["tags"]
+    row.update(
+        duration = info["duration"],
+        bitrate = info["bitrate"],
+        sample_rate = info["sample_rate"],
+        artwork = int(info["artwork"]),
+        bpm = to_float(tags.get("bpm")),
+    )
+    for name in ["title", "artist", "album", "genre", "year", "key", "isrc", "provider", "provider_id"]:
+        row[name] = tags.get(name, "")
+    row["missing"] = sum(1 << i for i, field in enumerate(FIELDS) if not row[field])
+    return row
+
+def empty(typecode: str):
+    return StringColumn.of([]) if typecode == "s" else array(typecode)
+
+def align(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+def to_float(value: str | None) -> float:
+    try: return float(value)
+    except (TypeError, ValueError): return 0
+
+if __name__ == "__main__":
+    # Benchmark a filter over a large synthetic snapshot
+    import random, time
+    count = 500000
+    rows = [{name: "" if typecode == "s" else 0 for name, typecode in COLUMNS.items()} for _ in range(count)]
+    for i, row in enumerate(rows):
+        row.update(path = f"/music/{i:06}.mp3", title = "Title", artwork = int(random.random() < 0.95), isrc = "" if random.random() < 0.1 else "USRC17607839")
+        row["missing"] = sum(1 << j for j, field in enumerate(FIELDS) if not row[field])
+    inventory = Inventory({name: StringColumn.of([row[name] for row in rows]) if typecode == "s" else array(typecode, [row[name] for row in rows])
+        for name, typecode in COLUMNS.items()}, count)
+    inventory.save("/tmp/inventory.bin")
+
+    start = time.perf_counter()
+    inventory = Inventory.load("/tmp/inventory.bin")
+    print(f"Loaded {inventory.count} files in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for fields in [["isrc"], ["isrc", "artwork"], ["title"]]:
+        start = time.perf_counter()
+        missing = inventory.missing(fields)
+        print(f"{len(missing)} files without {', '.join(fields)} found in {(time.perf_counter() - start) * 1000:.1f} ms")
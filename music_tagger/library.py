@@ -0,0 +1,114 @@
+import asyncio, time
+from argparse import Namespace
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import NamedTuple
+
+import requests
+
+from music_tagger import network
+from music_tagger.enrichment import TrackMetadata, check_analysis
+from music_tagger.matcher import Matcher
+from music_tagger.output import strip_colors
+from music_tagger.walker import walk
+
+class TagResult(NamedTuple):
+    """What happened to one file"""
+    path: Path
+    status: str # identified, unmatched, skipped or error
+    output: Path | None = None # where the file ended up, after renaming or converting
+    match: str | None = None
+    ratio: float | None = None
+    error: str | None = None
+    seconds: float = 0
+    metadata: TrackMetadata | None = None # the tags written
+
+    def to_dict(self) -> dict:
+        """JSON-friendly form"""
+        result = self._asdict()
+        result.update(path = str(self.path), output = str(self.output) if self.output else None)
+        result["metadata"] = self.metadata.get_tags() if self.metadata else None
+        return result
+
+def tag_library(paths: list[str | Path], options: dict = None, workers: int = 4, buffer: int = None,
+        session: requests.Session = None, cache_folder: str | Path = None):
+    """Tags files and folders, yielding a TagResult for each file as soon as it is done.
+
+    options are the command line options by name, e.g. {"format": "mp3", "no_shazam": True}.
+    At most buffer files (2 per worker by default) are worked on ahead of the consumer, so a slow
+    consumer slows tagging down instead of piling up results. session replaces the HTTP session
+    and cache_folder the folder of the catalog and artist caches, both for the whole process."""
+    args = create_args(options)
+    args.analysis = check_analysis(args.analysis)
+    configure(session, cache_folder)
+    Matcher.set_shazam_workers(args.shazam_workers)
+    buffer = buffer or workers * 2
+    files = (file for path in paths for file in walk(Path(path), args.include, args.exclude))
+
+    executor = ThreadPoolExecutor(workers, thread_name_prefix = "library")
+    pending = set()
+    try:
+        for file in files:
+            pending.add(executor.submit(tag_file, file, args))
+            if len(pending) < buffer: continue
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done: yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done: yield future.result()
+    finally:
+        # Also when the consumer stops early
+        executor.shutdown(wait = True, cancel_futures = True)
+
+async def tag_library_async(paths: list[str | Path], options: dict = None, workers: int = 4, buffer: int = None,
+        session: requests.Session = None, cache_folder: str | Path = None):
+    """tag_library for asyncio, the next file only starts when the consumer is ready for it"""
+    loop = asyncio.get_running_loop()
+    results = tag_library(paths, options, workers, buffer, session, cache_folder)
+    done = object()
+    try:
+        while (result := await loop.run_in_executor(None, next, results, done)) is not done:
+            yield result
+    finally:
+        try: await loop.run_in_executor(None, results.close)
+        except ValueError: pass # still running after a cancellation, it stops with the process
+
+def tag_file(path: Path, args) -> TagResult:
+    from music_tagger import tag_music
+
+    start = time.perf_counter()
+    try: file = tag_music(Path(path), args)
+    except Exception as e: return TagResult(Path(path), "error", error = str(e), seconds = time.perf_counter() - start)
+    if not file: return TagResult(Path(path), "skipped", seconds = time.perf_counter() - start)
+
+    return TagResult(
+        path = Path(path),
+        status = "identified" if file.identity else "unmatched",
+        output = file.path,
+        match = strip_colors(repr(file.identity)) if file.identity else None,
+        ratio = file.ratio,
+        error = file.error,
+        seconds = time.perf_counter() - start,
+        metadata = file.enrich(args.analysis) if file.identity and not args.simulate else None,
+    )
+
+def create_args(options: dict = None, defaults: Namespace = None) -> Namespace:
+    """The command line defaults, or the given defaults, with options applied, matching is never interactive.
+    Raises TypeError when options isn't a dict and ValueError for options the command line doesn't have."""
+    from music_tagger import create_parser
+
+    if options is None: options = {}
+    if not isinstance(options, dict): raise TypeError(f"options must be a dict, not {type(options).__name__}")
+    args = create_parser(file = False).parse_args([])
+    for name in options:
+        if not hasattr(args, name): raise ValueError(f"Unknown option {name}")
+    return Namespace(**{**vars(defaults or args), **options, "suppress": True})
+
+def configure(session: requests.Session = None, cache_folder: str | Path = None):
+    from music_tagger.catalog import CatalogAPI
+    from music_tagger.spotify import SpotifyArtists
+
+    if session: network.SESSION = session
+    if cache_folder:
+        CatalogAPI.use(Path(cache_folder) / "catalog.db")
+        SpotifyArtists.use(Path(cache_folder) / "artists.db")
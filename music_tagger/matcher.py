@@ -1,9 +1,17 @@
+import subprocess, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from threading import Event
 from shazam import Shazam
 from difflib import SequenceMatcher
-from requests import HTTPError
+from requests import RequestException
 
 from music_tagger import colors as Color
+from music_tagger import network
+from music_tagger.catalog import CatalogAPI, CatalogTrack
+from music_tagger.musicbrainz import MusicBrainzAPI, MusicBrainzTrack
+from music_tagger.metrics import METRICS
 from music_tagger.music_file import MusicFile
+from music_tagger.output import log, warn
 from music_tagger.shazam_track import ShazamTrack
 from music_tagger.soundcloud import SoundCloudAPI, SoundCloudTrack
 from music_tagger.spotify import SpotifyAPI, SpotifyTrack
@@ -13,46 +21,176 @@ class MatchError(Exception):
         super().__init__(reason)
 
 class Matcher:
-    __THRESHOLD = 0.8
-    __MIN_THRESHOLD = 0.6
+    # Tunable, see music-tagger evaluate
+    THRESHOLD = 0.8 # matches at least this good are accepted without asking
+    MIN_THRESHOLD = 0.6
+    DURATION_TOLERANCE = 1 # seconds
+    SHAZAM_OFFSETS = [0.2, 0.4, 0.6] # excerpts recognized at the same time, as a share of the duration
+    SHAZAM_EXCERPT = 12 # seconds
+    __EXECUTOR = ThreadPoolExecutor(32, thread_name_prefix = "matcher")
+    __shazam_workers = 2
+    __SHAZAM_EXECUTOR = ThreadPoolExecutor(__shazam_workers * len(SHAZAM_OFFSETS), thread_name_prefix = "shazam")
 
-    track = SpotifyTrack | SoundCloudTrack | ShazamTrack
-    api = SpotifyAPI | SoundCloudAPI
+    track = SpotifyTrack | SoundCloudTrack | ShazamTrack | CatalogTrack | MusicBrainzTrack
+    api = CatalogAPI | MusicBrainzAPI | SpotifyAPI | SoundCloudAPI
 
     @staticmethod
-    def identify(music_file: MusicFile, apis: list[api] = [SpotifyAPI, SoundCloudAPI], album_types = ["Single"], suppress: bool = False) -> tuple[track, float]:
-        all_results = {}
-        
-        for api in apis:
-            print(f"Matching with {api.NAME}...")
+    def identify(music_file: MusicFile, apis: list[api] = [CatalogAPI, MusicBrainzAPI, SpotifyAPI, SoundCloudAPI], album_types = ["Single"], suppress: bool = False, shazam: bool = True, confident: bool = False, deadline: float = 30, ids: bool = True, candidates: dict = None) -> tuple[track, float]:
+        """Finds the best match. With confident, matches below the threshold are rejected instead of returned.
+        Online providers are queried at the same time, and after deadline seconds the results so far are used.
+        Files with a stored provider id or an ISRC are looked up directly instead, unless ids is False.
+        candidates collects the results of every provider, and the results of an earlier call with other
+        providers in it are matched together with the new ones, e.g. to add Shazam to the text searches."""
+        match = Matcher.resolve([music_file], album_types).get(music_file.path) if ids else None
+        if match:
+            log("Found by its stored id or ISRC.")
+            return match
+        match = Matcher.__identify(music_file, apis, album_types, suppress, shazam, confident, deadline, {} if candidates is None else candidates)
+        if match: CatalogAPI.add(match[0])
+        return match
+
+    @staticmethod
+    def set_shazam_workers(workers: int):
+        """How many files are recognized at the same time, each probing every offset at once"""
+        if workers == Matcher.__shazam_workers: return
+        executor = Matcher.__SHAZAM_EXECUTOR
+        Matcher.__shazam_workers = workers
+        Matcher.__SHAZAM_EXECUTOR = ThreadPoolExecutor(workers * len(Matcher.SHAZAM_OFFSETS), thread_name_prefix = "shazam")
+        executor.shutdown(wait = False)
+
+    @staticmethod
+    def resolve(music_files: list[MusicFile], album_types: list[str] = ["Single"]) -> dict:
+        """Looks files up by the ids in their tags, stored provider ids first, then ISRCs, batched across files.
+        Returns the matches by path, files that can't be resolved this way are left out."""
+        matches = {}
+        Matcher.__resolve_ids(music_files, matches)
+        Matcher.__resolve_isrcs([file for file in music_files if file.path not in matches], album_types, matches)
+        return matches
+
+    @staticmethod
+    def __resolve_ids(music_files: list[MusicFile], matches: dict):
+        apis = {api.NAME: api for api in [SpotifyAPI, SoundCloudAPI, MusicBrainzAPI]}
+        ids = {} # provider -> id -> files
+        for file in music_files:
+            provider, id = file.get_provider_id() or (None, None)
+            if provider in apis: ids.setdefault(provider, {}).setdefault(id, []).append(file)
+
+        for provider, files_by_id in ids.items():
+            api = apis[provider]
+            try:
+                with METRICS.timer(f"{provider} ids"):
+                    tracks = network.breaker(provider).call(api.get_tracks, list(files_by_id))
+            except (RequestException, network.CircuitOpenError) as e:
+                warn(f"{Color.WARNING}{Color.BOLD}{provider}:{Color.ENDC} {e}")
+                continue
+            CatalogAPI.add_all(tracks)
+            for track in tracks:
+                for file in files_by_id.get(track.get_id(), []):
+                    if Matcher.__same_duration(file, track): matches[file.path] = track, 1.0
+
+    @staticmethod
+    def __resolve_isrcs(music_files: list[MusicFile], album_types: list[str], matches: dict):
+        isrcs = {} # isrc -> files
+        for file in music_files:
+            if file.get_isrc(): isrcs.setdefault(file.get_isrc(), []).append(file)
+        if not isrcs: return
+
+        # The catalog answers most of them in one query, Spotify and MusicBrainz the rest
+        candidates = {isrc: [track] for isrc, track in CatalogAPI.get_all(list(isrcs)).items()}
+        remaining = [isrc for isrc in isrcs if isrc not in candidates]
+        for isrc, tracks in zip(remaining, Matcher.__EXECUTOR.map(Matcher.__search_isrc, remaining)):
+            if tracks: candidates[isrc] = tracks
+        for isrc in [isrc for isrc in isrcs if isrc not in candidates]:
+            candidates[isrc] = MusicBrainzAPI.get(isrc)
+
+        for isrc, files in isrcs.items():
+            for file in files:
+                tracks = [track for track in candidates.get(isrc, []) if Matcher.__same_duration(file, track)]
+                # Prefer the release types asked for, the recording is the same either way
+                tracks.sort(key = lambda track: track.get_album_type() not in album_types)
+                if tracks: matches[file.path] = tracks[0], 1.0
+
+    @staticmethod
+    def __search_isrc(isrc: str) -> list[track]:
+        try:
+            with METRICS.timer("Spotify isrc"):
+                tracks = network.breaker(SpotifyAPI.NAME).call(network.hedged, SpotifyAPI.search, isrc = isrc, name = f"{SpotifyAPI.NAME} search")
+        except (RequestException, network.CircuitOpenError) as e:
+            warn(f"{Color.WARNING}{Color.BOLD}{SpotifyAPI.NAME}:{Color.ENDC} {e}")
+            return []
+        CatalogAPI.add_all(tracks)
+        return [track for track in tracks if (track.get_isrc() or "").upper() == isrc]
+
+    @staticmethod
+    def __same_duration(music_file: MusicFile, track: track) -> bool:
+        # Guards against wrong ids in the tags
+        return abs((track.get_duration() or 0) - music_file.get_duration()) <= Matcher.DURATION_TOLERANCE
+
+    @staticmethod
+    def __identify(music_file: MusicFile, apis: list[api], album_types: list[str], suppress: bool, use_shazam: bool, confident: bool, deadline: float, all_results: dict) -> tuple[track, float]:
+        end = time.monotonic() + deadline if deadline else None
+
+        # Local providers answer instantly, and may make the online ones unnecessary
+        for api in filter(lambda api: getattr(api, "LOCAL", False), apis):
+            log(f"Matching with {api.NAME}...")
             results = Matcher.__match(music_file, api)
             if not results: continue
             for track, ratio in results.items():
-                if ratio >= Matcher.__THRESHOLD and suppress: return track, ratio
+                if ratio >= Matcher.THRESHOLD and suppress: return track, ratio
             all_results.update(results)
 
-        print(f"Matching with Shazam...")
-        shazam = Matcher.__shazam(music_file)
+        futures = {}
+        stop = Event() # ends Shazam when it's no longer needed
+        for api in filter(lambda api: not getattr(api, "LOCAL", False), apis):
+            log(f"Matching with {api.NAME}...")
+            futures[Matcher.__EXECUTOR.submit(Matcher.__match, music_file, api)] = api
+        if use_shazam:
+            log(f"Matching with Shazam...")
+            futures[Matcher.__EXECUTOR.submit(Matcher.__timed_shazam, music_file, stop)] = None
+
+        shazam = None
+        try:
+            for future in as_completed(futures, timeout = end - time.monotonic() if end else None):
+                if futures[future] is None:
+                    shazam = future.result()
+                    continue
+                results = future.result()
+                if not results: continue
+                for track, ratio in results.items():
+                    if ratio >= Matcher.THRESHOLD and suppress:
+                        stop.set()
+                        for other in futures: other.cancel()
+                        return track, ratio
+                all_results.update(results)
+        except TimeoutError:
+            warn(f"{Color.WARNING}Deadline reached,{Color.ENDC} using the results so far.")
+            stop.set()
+            for future in futures: future.cancel()
+
         if shazam:
             shazam_result = Matcher.__check_results(music_file, [shazam])
-            shazam.get_spotify_metadata(all_results)
-            if shazam_result: all_results.update(shazam_result)
+            try:
+                shazam.find_spotify_metadata(all_results)
+                if shazam_result: all_results.update(shazam_result)
+            except (RequestException, network.CircuitOpenError) as e:
+                # Shazam's duration and album type come from Spotify, so it can't be filtered without it
+                warn(f"{Color.WARNING}{Color.BOLD}Spotify:{Color.ENDC} {e}")
 
         # Filtering
         # TODO: Accept Album, but pri Single
         if len(all_results.keys()) == 0: raise MatchError("No matches")
-        all_results = dict(filter(lambda item: abs(item[0].get_duration() - music_file.get_duration()) <= 1, all_results.items()))
+        all_results = dict(filter(lambda item: abs(item[0].get_duration() - music_file.get_duration()) <= Matcher.DURATION_TOLERANCE, all_results.items()))
         if len(all_results.keys()) == 0: raise MatchError("No matching durations")
         all_results = dict(filter(lambda item: item[0].get_album_type() in album_types, all_results.items()))
         if len(all_results.keys()) == 0: raise MatchError("No matching album types")
 
         all_results = dict(sorted(all_results.items(), key=lambda item: item[1], reverse=True))
+        if confident and list(all_results.values())[0] < Matcher.THRESHOLD: raise MatchError("No confident matches")
         if suppress: return list(all_results.items())[0]
 
         i = 0
         for result, ratio in all_results.items():
-            print(f"{i + 1}. ", end='')
-            Matcher.print_match(result, ratio)
+            print(f"{i + 1}. {Matcher.format_match(result, ratio)}")
             i += 1
 
         choice = input("Select best match (or nothing): ")
@@ -61,29 +199,104 @@ class Matcher:
 
     @staticmethod
     def print_match(match: track, ratio: float):
-        if ratio > 0.8: print(Color.OKGREEN, end='')
-        elif ratio > Matcher.__MIN_THRESHOLD: print(Color.WARNING, end='')
-        else: print(Color.FAIL, end='')
-        print(f"{ratio:.1%}:{Color.ENDC} {match}")
+        log(Matcher.format_match(match, ratio))
+
+    @staticmethod
+    def format_match(match: track, ratio: float) -> str:
+        if ratio > 0.8: color = Color.OKGREEN
+        elif ratio > Matcher.MIN_THRESHOLD: color = Color.WARNING
+        else: color = Color.FAIL
+        return f"{color}{ratio:.1%}:{Color.ENDC} {match}"
 
     @staticmethod
-    def __shazam(music_file: MusicFile) -> track:
-        with Shazam(music_file.read()) as shazam:
+    def __timed_shazam(music_file: MusicFile, stop: Event = None) -> track:
+        try:
+            with METRICS.timer("Shazam"):
+                result = network.breaker("Shazam").call(Matcher.recognize, music_file, stop)
+            return ShazamTrack(result) if result else None
+        except Exception as e:
+            warn(f"{Color.WARNING}{Color.BOLD}Shazam:{Color.ENDC} {e}")
+            return None
+
+    @staticmethod
+    def recognize(music_file: MusicFile, stop: Event = None) -> dict | None:
+        """The raw Shazam result for the audio. Short excerpts at several offsets are recognized at the same time,
+        so long intros and silence don't matter, and the first to find the track cancels the others.
+        Setting stop ends the recognition early, e.g. when the caller's deadline passes."""
+        stop = stop or Event()
+        duration = music_file.get_duration()
+        if duration < Matcher.SHAZAM_EXCERPT * 2: return Matcher.__recognize(music_file.read(), first = True, stop = stop)
+
+        futures = [Matcher.__SHAZAM_EXECUTOR.submit(Matcher.__probe, music_file, duration * offset, stop, i == 0)
+            for i, offset in enumerate(Matcher.SHAZAM_OFFSETS)]
+        error = None
+        try:
+            for future in as_completed(futures):
+                try: result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if result:
+                    METRICS.count(f"Shazam hit at {Matcher.SHAZAM_OFFSETS[futures.index(future)]:.0%}")
+                    return result
+        finally:
+            stop.set()
+            for future in futures: future.cancel()
+
+        # Only a failure if no excerpt could be recognized at all
+        if error and all(future.exception() for future in futures): raise error
+        return None
+
+    @staticmethod
+    def __probe(music_file: MusicFile, offset: float, stop: Event, fallback: bool = False) -> dict | None:
+        if stop.is_set(): return None
+        try:
+            audio = subprocess.run([
+                "ffmpeg", "-v", "error",
+                "-ss", str(offset), "-t", str(Matcher.SHAZAM_EXCERPT),
+                "-i", str(music_file.path),
+                "-ac", "1", "-ar", "16000",
+                "-f", "wav", "pipe:1"
+            ], stdin = subprocess.DEVNULL, capture_output = True, check = True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            # Without ffmpeg, one probe walks through the whole file instead
+            if not fallback: return None
+            audio = music_file.read()
+        return Matcher.__recognize(audio, stop = stop)
+
+    @staticmethod
+    def __recognize(audio: bytes, first: bool = False, stop: Event = None) -> dict | None:
+        with Shazam(audio) as shazam:
             for _, result in shazam.results:
-                if not result.get("track"): return None
-                return ShazamTrack(result)
+                if result.get("track"): return result
+                if first or stop and stop.is_set(): return None
 
     @staticmethod
     def __match(music_file: MusicFile, api: api) -> dict[track, float] | None:
+        """Scores results page by page, deeper pages and the next query are only fetched while nothing is confident"""
+        queries = [music_file.get_filename()]
+        if music_file.metadata: queries.append(music_file.to_string())
+        search = lambda query, **kwargs: network.breaker(api.NAME).call(network.hedged, api.search, query, name = f"{api.NAME} search", **kwargs)
+
+        matches = {}
+        confident = lambda: matches and max(matches.values()) >= Matcher.THRESHOLD
         try:
-            results = api.search(music_file.get_filename())
-            if music_file.metadata:
-                results.extend(api.search(music_file.to_string()))
-            results = list(dict.fromkeys(results))
-            return Matcher.__check_results(music_file, results)
-        except HTTPError as e:
-            print(e.request.url)
-            return None
+            with METRICS.timer(api.NAME):
+                for query in queries:
+                    pages = api.search_iter(query, search = search) if hasattr(api, "search_iter") else [api.search(query)]
+                    for page in pages:
+                        METRICS.count(f"{api.NAME} pages")
+                        # Results of local providers are searchable already, e.g. a MusicBrainz dump isn't copied
+                        if not getattr(api, "LOCAL", False): CatalogAPI.add_all(page)
+                        for track, ratio in (Matcher.__check_results(music_file, page) or {}).items():
+                            matches[track] = max(ratio, matches.get(track, 0))
+                        if confident(): break
+                    if confident(): break
+        except (RequestException, network.CircuitOpenError) as e:
+            warn(f"{Color.WARNING}{Color.BOLD}{api.NAME}:{Color.ENDC} {e}")
+            if not matches: return None
+        if not matches: return None
+        return dict(sorted(matches.items(), key = lambda item: item[1], reverse = True))
 
     
     @staticmethod
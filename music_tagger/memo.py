@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+
+from music_tagger.metrics import METRICS
+
+__LOCK = Lock()
+__SEEN = OrderedDict() # (name, track) -> None, of lookups already made by any object
+__SEEN_SIZE = 10000
+__LOCAL = local()
+
+def memoized(name: str):
+    """Caches a lookup on a track object, so it runs at most once per object, even from several threads.
+    Counts "name lookups" and "name cached" in METRICS, and "name duplicates" when another
+    object for the same track made the lookup before."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self):
+            cache, lock = get_cache(self, name)
+            with lock:
+                if name in cache:
+                    METRICS.count(f"{name} cached")
+                    return cache[name]
+                if getattr(__LOCAL, "cached_only", False): return None
+                METRICS.count(f"{name} lookups")
+                if seen(name, self): METRICS.count(f"{name} duplicates")
+                cache[name] = method(self)
+                return cache[name]
+        return wrapper
+    return decorator
+
+@contextmanager
+def cached_only():
+    """Lookups in this thread only return results found before, and None instead of going to the network"""
+    previous = getattr(__LOCAL, "cached_only", False)
+    __LOCAL.cached_only = True
+    try: yield
+    finally: __LOCAL.cached_only = previous
+
+def remember(obj, name: str, value):
+    """Stores a result found some other way, e.g. in a batch request, so the lookup is skipped"""
+    cache, lock = get_cache(obj, name)
+    with lock: cache[name] = value
+
+def get_cache(obj, name: str) -> tuple[dict, Lock]:
+    with __LOCK:
+        cache = obj.__dict__.setdefault("_memoized", {})
+        locks = obj.__dict__.setdefault("_memoized_locks", {})
+        return cache, locks.setdefault(name, Lock())
+
+def seen(name: str, obj) -> bool:
+    try: key = (name, type(obj).__name__, obj.get_id())
+    except Exception: return False
+    with __LOCK:
+        if key in __SEEN: return True
+        __SEEN[key] = None
+        if len(__SEEN) > __SEEN_SIZE: __SEEN.popitem(last = False)
+        return False
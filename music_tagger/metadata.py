@@ -2,15 +2,16 @@ import re
 from io import BytesIO
 
 import mutagen
-import requests
-from tempfile import TemporaryFile
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import APIC, ID3, ID3NoHeaderError
+from mutagen import PaddingInfo
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import APIC, COMM, ID3, TXXX, Frames
 from PIL import Image
 from PIL.Image import Resampling
 from pathlib import Path
 
 from music_tagger import colors as Color
+from music_tagger import network
+from music_tagger.output import log, warn
 from music_tagger import util as Regexes
 
 
@@ -31,6 +32,7 @@ class MetadataParser:
 
         self.genre = None
         self.year = None
+        self.__genre_regex = None # the genres in the title, stripped from the artists
 
         try:
             self.__parse_genre()
@@ -41,7 +43,7 @@ class MetadataParser:
             self.__parse_brackets()
             self.__parse_artists()
         except Exception as e:
-            print(f"{Color.WARNING}{Color.BOLD}METADATA PARSING ERROR: {Color.ENDC}{e}")
+            warn(f"{Color.WARNING}{Color.BOLD}METADATA PARSING ERROR: {Color.ENDC}{e}")
             raise e
 
     def __parse_title(self):
@@ -52,7 +54,7 @@ class MetadataParser:
                 self.title = re.findall(r"(.*?)\s*(?:[()\[\]]|ft|feat|$)", self.__filename, flags = re.I)[0].strip(self.__STRIP_BRACKETS)
         except IndexError:
             self.title = self.__filename
-            print(f"{Color.WARNING}{Color.BOLD}METADATA PARSING ERROR:{Color.ENDC} Couldn't parse title")
+            warn(f"{Color.WARNING}{Color.BOLD}METADATA PARSING ERROR:{Color.ENDC} Couldn't parse title")
         self.__filename = self.__filename.replace(self.title, "")
         self.__filename = re.sub(r"\s{2,}", " ", self.__filename)
 
@@ -92,13 +94,15 @@ class MetadataParser:
                 self.__filename = re.sub("\\bextended\s?", "", self.__filename, flags = re.I)
                 match = re.sub("\\bextended\s?", "", match, flags = re.I)
 
+            keywords = Regexes.KEYWORDS.scan(match)
+
             # Discard
-            if Regexes.IGNORE_REGEX.search(match):
+            if keywords.get("ignore"):
                 self.__filename = self.__filename.replace(match, "")
                 continue
 
             # Remix
-            elif Regexes.VERSION_REGEX.search(match):
+            elif keywords.get("version"):
                 remix_type = match.strip(self.__STRIP_BRACKETS).split()[-1].title()
                 remixers = self.__split_artists(re.sub(remix_type, "", match, flags = re.I).strip(self.__STRIP_BRACKETS))
                 if len(remixers) != 0:
@@ -120,15 +124,16 @@ class MetadataParser:
         except (IndexError, TypeError): pass
 
     def __parse_genre(self):
-        try: Regexes.GENRE_REGEX.search(self.__filename)[0]
-        except (IndexError, TypeError): pass
+        # The title is scanned for genres once, every artist comes from it
+        genres = Regexes.KEYWORDS.scan(self.__filename).get("genre")
+        if genres: self.__genre_regex = re.compile(r"\b(" + "|".join(map(re.escape, sorted(set(genres), key = len, reverse = True))) + r")\b", re.I)
 
     def __strip_year_genre(self, list: list[str]) -> list[str]:
         """Removes year and genre from list and returns a copy"""
         l = []
         for a in list:
-            n = Regexes.YEAR_REGEX.sub("", a).strip()
-            n = Regexes.GENRE_REGEX.sub("", n).strip()
+            n = Regexes.YEAR_REGEX.sub("", a).strip() if self.year else a.strip()
+            if self.__genre_regex: n = self.__genre_regex.sub("", n).strip()
             l.append(n)
         return l
 
@@ -225,57 +230,226 @@ Year:           {self.year}
 Genre:          {self.genre}"""
 
 
-# EMBED METADATA TO FILE
-def embed_metadata(filepath: Path, no_overwrite: bool = False, **kwargs):
-    try:
-        tags = EasyID3(filepath)
-    except ID3NoHeaderError:
-        tags = mutagen.File(filepath, easy=True)
-        tags.add_tags()
-    
-    EasyID3.RegisterTextKey('comment', 'COMM')
-    EasyID3.RegisterTextKey('year', 'TYER')
-    EasyID3.RegisterTextKey('key', 'TKEY')
-    EasyID3.RegisterTextKey('label', 'TPUB')
-    EasyID3.RegisterTXXXKey("explicit", "itunesadvisory")
-    EasyID3.RegisterTXXXKey("url", "url")
-
-    print("Embedding metadata...")
-    for tag, value in kwargs.items():
-        if no_overwrite and tag in tags.keys() or not value: continue
-        if tag in tags.keys(): tags.pop(tag)
-        if value is bool: value = 1 if value else 0
-        tags[tag] = str(value)
-
-    tags.save()
-
-def embed_artwork(filepath: Path, url: str, size: int = 800, no_overwrite: bool = False):
-    try: tags = ID3(filepath)
-    except ID3NoHeaderError:
-        tags = mutagen.File(filepath)
-        tags.add_tags()
+# READ AND EMBED METADATA
+__PADDING = 16 * 1024 # Room left for later tag updates
+
+__ID3_FRAMES = {
+    "album": "TALB",
+    "albumartist": "TPE2",
+    "artist": "TPE1",
+    "bpm": "TBPM",
+    "comment": "COMM",
+    "genre": "TCON",
+    "isrc": "TSRC",
+    "key": "TKEY",
+    "label": "TPUB",
+    "title": "TIT2",
+    "year": "TDRC",
+    "explicit": "TXXX:itunesadvisory",
+    "url": "TXXX:url",
+    "provider": "TXXX:provider",
+    "provider_id": "TXXX:provider_id",
+}
+
+__VORBIS_KEYS = {
+    "album": "album",
+    "albumartist": "albumartist",
+    "artist": "artist",
+    "bpm": "bpm",
+    "comment": "comment",
+    "genre": "genre",
+    "isrc": "isrc",
+    "key": "initialkey",
+    "label": "label",
+    "title": "title",
+    "year": "date",
+    "explicit": "itunesadvisory",
+    "url": "url",
+    "provider": "provider",
+    "provider_id": "provider_id",
+}
+
+def read_metadata(filepath: Path) -> dict | None:
+    """Reads the tags of any supported format into a flat dict with the keys used by embed_metadata"""
+    try: file = mutagen.File(filepath)
+    except mutagen.MutagenError: return None # truncated or not audio at all
+    if not file or not file.tags: return None
+    return __read_tags(file) or None
+
+def read_info(filepath: Path) -> dict | None:
+    """Reads tags, artwork presence and stream info with a single parse"""
+    try: file = mutagen.File(filepath)
+    except mutagen.MutagenError: return None
+    if file is None: return None
+    return {
+        "tags": __read_tags(file) if file.tags else {},
+        "artwork": bool(file.tags or isinstance(file, FLAC)) and __get_artwork(file) is not None,
+        "duration": file.info.length,
+        "bitrate": getattr(file.info, "bitrate", 0) or 0,
+        "sample_rate": getattr(file.info, "sample_rate", 0) or 0,
+    }
+
+def __read_tags(file: mutagen.FileType) -> dict:
+    metadata = {}
+    for tag in __ID3_FRAMES.keys():
+        value = __get_tag(file.tags, tag)
+        if value: metadata[tag] = value
+    return metadata
+
+def embed_metadata(filepath: Path, no_overwrite: bool = False, verbose: bool = True, **kwargs) -> bool:
+    """Writes the tags in the file's native format, returns False if they were already up to date"""
+    file = __open(filepath)
+    changed = False
 
-    if no_overwrite and "APIC:" in tags.keys(): return
-    print("Embedding artwork...")
-    tags.delall("APIC")
-
-    r = requests.get(url)
+    for tag, value in kwargs.items():
+        if not value: continue
+        if isinstance(value, bool): value = 1 if value else 0
+        current = __get_tag(file.tags, tag)
+        if current == str(value) or no_overwrite and current: continue
+        __set_tag(file.tags, tag, str(value))
+        changed = True
+
+    if not changed: return False
+    if verbose: log("Embedding metadata...")
+    __save(file)
+    return True
+
+def read_artwork(filepath: Path) -> bytes | None:
+    file = mutagen.File(filepath)
+    if not file or not file.tags and not isinstance(file, FLAC): return None
+    return __get_artwork(file)
+
+def embed_artwork(filepath: Path, artwork: str | bytes, size: int = 800, no_overwrite: bool = False) -> bool:
+    """Embeds artwork from a URL, or JPEG data downloaded already"""
+    if not artwork: return False
+    file = __open(filepath)
+    current = __get_artwork(file)
+    if no_overwrite and current: return False
+
+    if isinstance(artwork, bytes): data, image = artwork, Image.open(BytesIO(artwork))
+    else: data, image = fetch_artwork(artwork, size)
+    if data == current: return False
+    log("Embedding artwork...")
+
+    if isinstance(file, FLAC):
+        picture = Picture()
+        picture.type = 3
+        picture.mime = "image/jpeg"
+        picture.width, picture.height = image.size
+        picture.depth = 24
+        picture.data = data
+        file.clear_pictures()
+        file.add_picture(picture)
+    else:
+        file.tags.delall("APIC")
+        file.tags.add(APIC(
+            encoding = 3,
+            mime = "image/jpeg",
+            type = 3,
+            data = data))
+
+    __save(file)
+    return True
+
+def fetch_artwork(url: str, size: int = 800) -> tuple[bytes, Image.Image]:
+    """Downloads the artwork as a JPEG no larger than size"""
+    r = network.get(url)
+    r.raise_for_status()
     image = Image.open(BytesIO(r.content))
 
     if image.width > size or image.height > size:
         image.thumbnail((size, size), Resampling.LANCZOS)
-    tmp = TemporaryFile()
-    image.save(tmp, format = "jpeg")
-    tmp.seek(0)
-
-    tags["APIC"] = APIC(
-        encoding = 3,
-        mime = "image/jpeg",
-        type = 3,
-        data = tmp.read())
-
-    tmp.close()
-    tags.save()
+    tmp = BytesIO()
+    image.convert("RGB").save(tmp, format = "jpeg")
+    return tmp.getvalue(), image
+
+def ffmpeg_metadata(format: str, **kwargs) -> tuple[list[str], dict]:
+    """The -metadata arguments writing the tags in the format's native layout, and the tags ffmpeg can't write"""
+    args, rest = [], {}
+    for tag, value in kwargs.items():
+        if not value: continue
+        if isinstance(value, bool): value = 1 if value else 0
+
+        # ffmpeg writes comments as TXXX frames or DESCRIPTION, and WAV tags as RIFF INFO instead of ID3
+        if tag == "comment" or format not in [".mp3", ".flac"]:
+            rest[tag] = value
+            continue
+        if format == ".flac": key = __VORBIS_KEYS.get(tag, tag)
+        else:
+            # Frame ids are written as is, and other keys as TXXX frames
+            key = __ID3_FRAMES.get(tag, tag)
+            if key.startswith("TXXX:"): key = key[5:]
+        args += ["-metadata", f"{key}={value}"]
+    return args, rest
+
+def create_id3(filepath: Path, artwork: bytes = None, **kwargs):
+    """Starts an empty file with an ID3 tag, so the audio can be appended after it"""
+    tags = ID3()
+    for tag, value in kwargs.items():
+        if not value: continue
+        if isinstance(value, bool): value = 1 if value else 0
+        __set_tag(tags, tag, str(value))
+    if artwork:
+        tags.add(APIC(
+            encoding = 3,
+            mime = "image/jpeg",
+            type = 3,
+            data = artwork))
+
+    Path(filepath).write_bytes(b"")
+    tags.save(filepath, v2_version = 4, padding = __padding)
+
+def __open(filepath: Path) -> mutagen.FileType:
+    file = mutagen.File(filepath)
+    if file is None: raise ValueError(f"{Path(filepath).name} is not a supported audio file")
+    if file.tags is None: file.add_tags()
+    return file
+
+def __save(file: mutagen.FileType):
+    if isinstance(file.tags, ID3): file.save(v2_version = 4, padding = __padding)
+    else: file.save(padding = __padding)
+
+def __padding(info: PaddingInfo) -> int:
+    """Rewrites the tags in place whenever they fit, and leaves room for the next update when they don't"""
+    if info.padding >= 0: return info.padding
+    return __PADDING
+
+def __get_tag(tags, tag: str) -> str | None:
+    if isinstance(tags, ID3):
+        frame_id = __ID3_FRAMES.get(tag)
+        if frame_id == "COMM":
+            frames = [frame for frame in tags.getall("COMM") if frame.desc == ""]
+        else: frames = tags.getall(frame_id) if frame_id else []
+        if frames and frames[0].text: return str(frames[0].text[0])
+        return None
+
+    values = tags.get(__VORBIS_KEYS.get(tag, tag))
+    if values: return values[0]
+    return None
+
+def __set_tag(tags, tag: str, value: str):
+    if isinstance(tags, ID3):
+        frame_id = __ID3_FRAMES[tag]
+        if frame_id == "COMM":
+            for frame in tags.getall("COMM"):
+                if frame.desc == "": del tags[frame.HashKey]
+            tags.add(COMM(encoding = 3, lang = "eng", desc = "", text = value))
+        elif frame_id.startswith("TXXX:"):
+            tags.delall(frame_id)
+            tags.add(TXXX(encoding = 3, desc = frame_id[5:], text = value))
+        else:
+            tags.delall(frame_id)
+            tags.add(Frames[frame_id](encoding = 3, text = value))
+        return
+
+    tags[__VORBIS_KEYS.get(tag, tag)] = [value]
+
+def __get_artwork(file: mutagen.FileType) -> bytes | None:
+    if isinstance(file, FLAC):
+        pictures = [picture for picture in file.pictures if picture.type == 3]
+        return pictures[0].data if pictures else None
+    frames = file.tags.getall("APIC")
+    return frames[0].data if frames else None
 
 if __name__ == "__main__":
     parse = MetadataParser(
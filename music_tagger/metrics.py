@@ -0,0 +1,65 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+class Metrics:
+    """Thread-safe counters and latency samples"""
+    __WINDOW = 1000 # latency samples kept per name
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__counters = {}
+        self.__latencies = {}
+        self.__started = time.time()
+
+    def count(self, name: str, amount: int = 1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + amount
+
+    def get(self, name: str) -> int:
+        return self.__counters.get(name, 0)
+
+    def observe(self, name: str, seconds: float):
+        with self.__lock:
+            samples = self.__latencies.setdefault(name, deque(maxlen = Metrics.__WINDOW))
+            samples.append(seconds)
+            self.__counters[name] = self.__counters.get(name, 0) + 1
+
+    def percentile(self, name: str, q: float) -> float | None:
+        with self.__lock:
+            samples = sorted(self.__latencies.get(name, []))
+        if not samples: return None
+        return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try: yield
+        finally: self.observe(name, time.perf_counter() - start)
+
+    def reset(self):
+        with self.__lock:
+            self.__counters.clear()
+            self.__latencies.clear()
+            self.__started = time.time()
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            latencies = {}
+            for name, samples in self.__latencies.items():
+                ordered = sorted(samples)
+                latencies[name] = {
+                    "count": self.__counters.get(name, 0),
+                    "mean": sum(ordered) / len(ordered),
+                    "p50": ordered[len(ordered) // 2],
+                    "p95": ordered[int(len(ordered) * 0.95)],
+                    "max": ordered[-1],
+                }
+            return {
+                "uptime": time.time() - self.__started,
+                "counters": {name: value for name, value in self.__counters.items() if name not in latencies},
+                "latencies": latencies,
+            }
+
+METRICS = Metrics()
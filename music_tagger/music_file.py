@@ -1,9 +1,11 @@
-import os, mutagen
+import os, mutagen, subprocess
+from contextlib import nullcontext
 from pathlib import Path
 
-from music_tagger.metadata import embed_artwork, embed_metadata
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3NoHeaderError, TIT2, TPE1, TALB
+from music_tagger import colors as Color
+from music_tagger.output import error, log, warn
+from music_tagger.metadata import create_id3, embed_artwork, embed_metadata, ffmpeg_metadata, read_artwork, read_metadata
+from mutagen.id3 import TIT2, TPE1, TALB
 
 class MusicFile:
     def __init__(self, filepath: str):
@@ -14,6 +16,10 @@ class MusicFile:
 
         self.metadata = self.__get_embedded_metadata()
         self.identity = None
+        self.ratio = None
+        self.error = None
+        self.candidates = {} # every result found for the file so far
+        self.__record = None
 
     def get_ext(self) -> str:
         return self.path.suffix
@@ -22,26 +28,35 @@ class MusicFile:
         return self.path.with_suffix('').name
 
     def get_title(self) -> str | None:
-        title = self.metadata.get("TIT2")
-        if not title: title = self.metadata.get("title")
+        title = (self.metadata or {}).get("TIT2")
+        if not title: title = (self.metadata or {}).get("title")
         if title is TIT2: return title.text
         if title is list and len(title) != 0: return title[0]
         return title
 
     def get_artist(self) -> str | None:
-        artist = self.metadata.get("TPE1")
-        if not artist: artist = self.metadata.get("artist")
+        artist = (self.metadata or {}).get("TPE1")
+        if not artist: artist = (self.metadata or {}).get("artist")
         if artist is TPE1: return artist.text
         if artist is list and len(artist) != 0: return artist[0]
         return artist
 
     def get_album(self) -> str | None:
-        album = self.metadata.get("TPE1")
-        if not album: album = self.metadata.get("album")
+        album = (self.metadata or {}).get("TPE1")
+        if not album: album = (self.metadata or {}).get("album")
         if album is TALB: return album.text
         if album is list and len(album) != 0: return album[0]
         return album
 
+    def get_isrc(self) -> str | None:
+        isrc = (self.metadata or {}).get("isrc")
+        if isrc: return isrc.strip().upper().replace("-", "")
+
+    def get_provider_id(self) -> tuple[str, str] | None:
+        """The provider and id the file was tagged from before"""
+        metadata = self.metadata or {}
+        if metadata.get("provider") and metadata.get("provider_id"): return metadata["provider"], metadata["provider_id"]
+
     def get_duration(self) -> int:
         file = mutagen.File(self.path)
         return round(file.info.length)
@@ -49,58 +64,117 @@ class MusicFile:
     def read(self):
         return self.path.read_bytes()
 
-    def identify(self, suppress = False):
+    def identify(self, suppress = False, shazam = True, confident = False, deadline = 30, ids = True, apis = None):
         from music_tagger.matcher import Matcher
-        self.identity, ratio = Matcher.identify(self, suppress = suppress)
-        return self.identity, ratio
+        options = {"apis": apis} if apis is not None else {}
+        self.identity, self.ratio = Matcher.identify(self, suppress = suppress, shazam = shazam, confident = confident, deadline = deadline, ids = ids, candidates = self.candidates, **options)
+        return self.identity, self.ratio
 
     def __get_embedded_metadata(self) -> dict | None:
-        try: tags = EasyID3(self.path)
-        except ID3NoHeaderError: return None
-        clean_tags = {}
-        for key in tags: clean_tags[key] = tags[key][0]
-        return clean_tags
-
-    def convert(self, format: str = ".mp3", no_overwrite: bool = False):
-        print("Converting...")
-        os.system(f"ffmpeg -i \"{self.path}\" -map_metadata 0 -v error -y -vn -ac 2 -id3v2_version 4 -b:a 320k \"{self.path.with_suffix('')}{format}\"")
-        if not no_overwrite: os.remove(self.path)
-        self.path = Path(self.path.with_suffix(format))
+        return read_metadata(self.path)
+
+    # Output options per format, and the formats ffmpeg can embed artwork in
+    __FFMPEG_OPTIONS = {
+        ".mp3": ["-b:a", "320k", "-id3v2_version", "4"],
+        ".flac": [],
+    }
+    __FFMPEG_ARTWORK = [".mp3", ".flac"]
+
+    def convert(self, formats: list[str] | str = ".mp3", no_overwrite: bool = False, analysis: str = "fallback", keep: bool = False):
+        """Encodes every format from a single decode, tagged in the same pass and written under the final filename"""
+        if isinstance(formats, str): formats = [formats]
+        formats = [format for format in formats if format != self.get_ext()]
+        if not formats: return self
+
+        record = self.enrich(analysis)
+        tags = record.get_tags() if record else None
+        artwork = record.artwork if record else None
+        existing = None
+        if tags and no_overwrite:
+            # Existing tags and artwork win
+            tags = {**tags, **(read_metadata(self.path) or {})}
+            existing = read_artwork(self.path)
+            if existing: artwork = None
+
+        filename = self.path.with_suffix('').name
+        if tags is not None and not no_overwrite: filename = self.get_identity_name()
+
+        command = ["ffmpeg", "-v", "error", "-y", "-i", str(self.path)]
+        if artwork: command += ["-f", "jpeg_pipe", "-i", "pipe:0"]
+        outputs, rest, header = [], {}, None
+        for format in formats:
+            target = self.__get_target(filename, format)
+            outputs.append(target)
+            command += ["-map", "0:a:0", "-ac", "2"]
+
+            # ffmpeg can't write ID3 comments, so MP3s get their tag first and the audio appended after it
+            if format == ".mp3" and tags is not None:
+                header = target
+                command += ["-b:a", "320k", "-f", "mp3", "-write_id3v2", "0", "-write_xing", "0", "pipe:1"]
+                continue
+
+            if format in MusicFile.__FFMPEG_ARTWORK:
+                command += ["-map", "1:v" if artwork else "0:v?", "-c:v", "copy", "-disposition:v", "attached_pic", "-metadata:s:v", "comment=Cover (front)"]
+            command += ["-map_metadata", "0"] + MusicFile.__FFMPEG_OPTIONS.get(format, [])
+            if tags:
+                args, rest[target] = ffmpeg_metadata(format, **tags)
+                command += args
+            command.append(str(target))
+
+        log("Converting...")
+        if header: create_id3(header, artwork or existing, **tags)
+        with open(header, "ab") if header else nullcontext() as stdout:
+            process = subprocess.run(command, input = artwork, stdout = stdout, stderr = subprocess.PIPE)
+        if process.returncode != 0:
+            error(f"{Color.FAIL}{Color.BOLD}CONVERSION ERROR:{Color.ENDC} {process.stderr.decode(errors = 'replace').strip()}")
+            if header: os.remove(header)
+            return self
+
+        # What ffmpeg can't write is added afterwards, which only rewrites the tags, not the audio
+        for target in outputs:
+            if rest.get(target): embed_metadata(target, no_overwrite, **rest[target])
+            if artwork and target.suffix not in MusicFile.__FFMPEG_ARTWORK:
+                embed_artwork(target, artwork, no_overwrite = no_overwrite)
+
+        if not keep and not no_overwrite: os.remove(self.path)
+        self.path = outputs[0]
         return self
 
     def rename(self, filename: str):
-        print("Renaming...")
-        self.path = self.path.rename(os.path.join(self.path.parent, filename + self.get_ext()))
-
-    def write_metadata(self, no_overwrite: bool = False):
-        from music_tagger.soundcloud import SoundCloudTrack
-        from music_tagger.spotify import SpotifyTrack
-        from music_tagger.shazam_track import ShazamTrack
-
+        target = Path(os.path.join(self.path.parent, filename + self.get_ext()))
+        if target == self.path: return
+        if target.exists() and target != self.path:
+            warn(f"{Color.WARNING}{Color.BOLD}NOT RENAMED:{Color.ENDC} {target.name} already exists")
+            return
+        log("Renaming...")
+        self.path = self.path.rename(target)
+
+    def write_metadata(self, no_overwrite: bool = False, analysis: str = "fallback"):
         # TODO: Metadata parser if no identity
-        if not self.identity: return
-        match: SpotifyTrack | SoundCloudTrack | ShazamTrack = self.identity
-        if match.get_spotify_metadata():
-            match = match.get_spotify_metadata()
-
-        embed_metadata(self.path, no_overwrite, 
-            album = match.get_album(),
-            albumartist = match.get_album_artist(),
-            artist = match.get_artist(),
-            bpm = match.get_tempo(),
-            comment = match.get_camelot_key(),
-            explicit = match.is_explicit(),
-            genre = match.get_genre(),
-            isrc = match.get_isrc(),
-            key = match.get_musical_key(),
-            label = match.get_label(),
-            title = match.get_title(),
-            year = match.get_year(),
-            url = match.get_url(),
-        )
-        embed_artwork(self.path, match.get_artwork(), no_overwrite = no_overwrite)
+        record = self.enrich(analysis)
+        if not record: return
+        embed_metadata(self.path, no_overwrite, **record.get_tags())
+        embed_artwork(self.path, record.artwork, no_overwrite = no_overwrite)
         if no_overwrite: return
-        self.rename(f"{match.get_artist()} - {match.get_title()}")
+        self.rename(self.get_identity_name())
+
+    def enrich(self, analysis: str = "fallback"):
+        """Fetches everything written for the identity at once, shared by every output"""
+        from music_tagger.enrichment import enrich
+        if not self.identity: return None
+        if self.__record is None: self.__record = enrich(self.identity, self.path, analysis)
+        return self.__record
+
+    def get_identity_name(self) -> str:
+        record = self.enrich()
+        return f"{record.artist} - {record.title}"
+
+    def __get_target(self, filename: str, format: str) -> Path:
+        target = self.path.parent / (filename + format)
+        if target.exists() and target != self.path and filename != self.path.with_suffix('').name:
+            warn(f"{Color.WARNING}{Color.BOLD}NOT RENAMED:{Color.ENDC} {target.name} already exists")
+            target = self.path.with_suffix(format)
+        return target
 
     def to_string(self) -> str:
         ret = ""
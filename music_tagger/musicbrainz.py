@@ -0,0 +1,263 @@
+import gzip, json, lzma, sqlite3, tarfile
+from os.path import join
+from pathlib import Path
+from threading import Lock
+
+from music_tagger import colors as Color
+from music_tagger.catalog import CANDIDATES, create_index, fts_query, normalize
+from music_tagger.util import FOLDER
+
+class MusicBrainzAPI:
+    """Offline MusicBrainz provider, searching a locally imported recording dump instead of the rate-limited web API."""
+    NAME = "MusicBrainz"
+    LOCAL = True
+    __DATABASE = Path(join(FOLDER, "musicbrainz.db"))
+    __COLUMNS = [
+        "mbid",
+        "title",
+        "artist",
+        "album",
+        "album_artist",
+        "album_type",
+        "duration",
+        "genre",
+        "label",
+        "year",
+        "isrc",
+    ]
+    __BATCH = 10000
+
+    __connection = None
+    __lock = Lock()
+
+    @staticmethod
+    def connect() -> sqlite3.Connection:
+        if MusicBrainzAPI.__connection: return MusicBrainzAPI.__connection
+        MusicBrainzAPI.__DATABASE.parent.mkdir(parents = True, exist_ok = True)
+        connection = sqlite3.connect(MusicBrainzAPI.__DATABASE, check_same_thread = False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(f"""CREATE TABLE IF NOT EXISTS recordings (
+            {", ".join(MusicBrainzAPI.__COLUMNS)},
+            UNIQUE (mbid))""")
+        connection.execute("CREATE TABLE IF NOT EXISTS isrcs (isrc TEXT, recording INTEGER, PRIMARY KEY (isrc, recording)) WITHOUT ROWID")
+        create_index(connection, "recordings_index", "SELECT rowid, normalize(COALESCE(artist, '') || ' ' || COALESCE(title, '') || ' ' || COALESCE(album, '')) FROM recordings")
+        MusicBrainzAPI.__connection = connection
+        return connection
+
+    @staticmethod
+    def use(database: Path):
+        """Keeps the recordings in another file from now on"""
+        with MusicBrainzAPI.__lock:
+            MusicBrainzAPI.__DATABASE = Path(database)
+            MusicBrainzAPI.__connection = None
+
+    @staticmethod
+    def is_imported() -> bool:
+        return MusicBrainzAPI.__DATABASE.is_file()
+
+    @staticmethod
+    def search(query: str = "", limit: int = 5) -> list:
+        # Nothing to search until a dump is imported
+        if not MusicBrainzAPI.is_imported(): return []
+        match = fts_query(query)
+        if not match: return []
+        with MusicBrainzAPI.__lock:
+            rows = MusicBrainzAPI.connect().execute("""
+                SELECT recordings.* FROM (SELECT rowid, search FROM recordings_index WHERE recordings_index MATCH ? LIMIT ?) AS hits
+                JOIN recordings ON recordings.rowid = hits.rowid
+                ORDER BY length(hits.search) LIMIT ?""", (match, CANDIDATES, limit)).fetchall()
+        return [MusicBrainzTrack(row) for row in rows]
+
+    @staticmethod
+    def get(isrc: str) -> list:
+        """All recordings with the ISRC"""
+        if not MusicBrainzAPI.is_imported(): return []
+        with MusicBrainzAPI.__lock:
+            rows = MusicBrainzAPI.connect().execute("""
+                SELECT recordings.* FROM isrcs
+                JOIN recordings ON recordings.rowid = isrcs.recording
+                WHERE isrcs.isrc = ?""", (isrc.upper(),)).fetchall()
+        return [MusicBrainzTrack(row) for row in rows]
+
+    @staticmethod
+    def get_tracks(ids: list[str]) -> list:
+        if not MusicBrainzAPI.is_imported(): return []
+        with MusicBrainzAPI.__lock:
+            rows = MusicBrainzAPI.connect().execute(f"""
+                SELECT * FROM recordings WHERE mbid IN ({", ".join("?" * len(ids))})""", ids).fetchall()
+        return [MusicBrainzTrack(row) for row in rows]
+
+    @staticmethod
+    def import_dump(filepath: Path) -> int:
+        """Imports recordings from a MusicBrainz JSON dump (recording.tar.xz, or JSON lines, optionally .gz/.xz)"""
+        count = 0
+        batch = []
+        for data in read_dump(Path(filepath)):
+            row = MusicBrainzAPI.__to_row(data)
+            if not row: continue
+            batch.append(row)
+            if len(batch) >= MusicBrainzAPI.__BATCH:
+                count += MusicBrainzAPI.__insert(batch)
+                batch = []
+                print(f"\rImported {count} recordings...", end = '')
+        count += MusicBrainzAPI.__insert(batch)
+        print(f"\rImported {count} recordings.")
+
+        with MusicBrainzAPI.__lock:
+            MusicBrainzAPI.connect().execute("INSERT INTO recordings_index (recordings_index) VALUES ('optimize')")
+            MusicBrainzAPI.connect().commit()
+        return count
+
+    @staticmethod
+    def __insert(rows: list[dict]) -> int:
+        if not rows: return 0
+        columns = MusicBrainzAPI.__COLUMNS
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        with MusicBrainzAPI.__lock, MusicBrainzAPI.connect() as connection:
+            for row in rows:
+                rowid = connection.execute(f"""
+                    INSERT INTO recordings ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})
+                    ON CONFLICT(mbid) DO UPDATE SET {updates}
+                    RETURNING rowid""", [row.get(column) for column in columns]).fetchone()[0]
+                connection.execute("DELETE FROM recordings_index WHERE rowid = ?", (rowid,))
+                connection.execute("INSERT INTO recordings_index (rowid, search) VALUES (?, ?)",
+                    (rowid, normalize(f"{row.get('artist')} {row.get('title')} {row.get('album') or ''}")))
+                connection.execute("DELETE FROM isrcs WHERE recording = ?", (rowid,))
+                connection.executemany("INSERT OR IGNORE INTO isrcs (isrc, recording) VALUES (?, ?)",
+                    [(isrc.upper(), rowid) for isrc in row.get("isrcs", [])])
+        return len(rows)
+
+    @staticmethod
+    def __to_row(data: dict) -> dict | None:
+        if not data.get("id") or not data.get("title"): return None
+        row = {
+            "mbid": data["id"],
+            "title": data["title"],
+            "artist": join_credits(data.get("artist-credit", [])),
+            "duration": round(data["length"] / 1000) if data.get("length") else None,
+            "isrcs": data.get("isrcs", []),
+            "year": parse_year(data.get("first-release-date")),
+        }
+        row["isrc"] = row["isrcs"][0] if row["isrcs"] else None
+
+        genres = sorted(data.get("genres", []), key = lambda genre: genre.get("count", 0), reverse = True)
+        if genres: row["genre"] = genres[0].get("name", "").title()
+
+        # Only present in dumps with releases included, prefer official singles
+        releases = data.get("releases", [])
+        releases = sorted(releases, key = lambda release: (
+            release.get("status") != "Official",
+            release.get("release-group", {}).get("primary-type") != "Single",
+            release.get("date") or "9999"))
+        if releases:
+            release = releases[0]
+            row["album"] = release.get("title")
+            row["album_artist"] = join_credits(release.get("artist-credit", [])) or None
+            row["album_type"] = release.get("release-group", {}).get("primary-type")
+            row["year"] = parse_year(release.get("date")) or row["year"]
+            labels = [info.get("label", {}).get("name") for info in release.get("label-info", []) if info.get("label")]
+            if labels: row["label"] = labels[0]
+        return row
+
+class MusicBrainzTrack:
+    def __init__(self, row: sqlite3.Row):
+        self.__row = dict(row)
+
+    def get_id(self) -> str:
+        return self.__row.get("mbid")
+
+    def get_title(self) -> str:
+        return self.__row.get("title")
+
+    def get_artist(self) -> str:
+        return self.__row.get("artist")
+
+    def get_album_artist(self) -> str | None:
+        return self.__row.get("album_artist")
+
+    def get_album(self) -> str:
+        return self.__row.get("album") or ""
+
+    def get_album_type(self) -> str | None:
+        return self.__row.get("album_type")
+
+    def get_isrc(self) -> str | None:
+        return self.__row.get("isrc")
+
+    def get_year(self) -> int | None:
+        return self.__row.get("year")
+
+    def get_artwork(self) -> str | None:
+        return None
+
+    def get_duration(self) -> int:
+        return self.__row.get("duration") or 0
+
+    def get_genre(self) -> str | None:
+        return self.__row.get("genre")
+
+    def get_label(self) -> str | None:
+        return self.__row.get("label")
+
+    def is_explicit(self) -> bool | None:
+        return None
+
+    def get_tempo(self) -> int | None:
+        return None
+
+    def get_camelot_key(self) -> str | None:
+        return None
+
+    def get_musical_key(self) -> str | None:
+        return None
+
+    def get_url(self) -> str:
+        return f"https://musicbrainz.org/recording/{self.get_id()}"
+
+    def get_spotify_metadata(self): return None
+
+    def to_string(self) -> str:
+        return f"{self.get_artist()} - {self.get_title()} - {self.get_album()}"
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, self.__class__) and self.get_id() == other.get_id()
+
+    def __hash__(self) -> int:
+        return hash(self.get_id())
+
+    def __repr__(self) -> str:
+        return f"{self.to_string()}: {Color.OKBLUE}{Color.UNDERLINE}{self.get_url()}{Color.ENDC}"
+
+# HELPERS
+def read_dump(filepath: Path):
+    """Yields one recording at a time, without loading the dump into memory"""
+    if tarfile.is_tarfile(filepath):
+        with tarfile.open(filepath) as archive:
+            for member in archive:
+                if not member.isfile() or Path(member.name).name != "recording": continue
+                yield from read_lines(archive.extractfile(member))
+        return
+
+    opener = {".gz": gzip.open, ".xz": lzma.open}.get(filepath.suffix, open)
+    with opener(filepath, "rb") as file:
+        yield from read_lines(file)
+
+def read_lines(file):
+    for line in file:
+        if not line.strip(): continue
+        try: yield json.loads(line)
+        except ValueError: continue
+
+def join_credits(credits: list[dict]) -> str:
+    return "".join(credit.get("name", "") + credit.get("joinphrase", "") for credit in credits)
+
+def parse_year(date: str | None) -> int | None:
+    if not date or not date[:4].isdigit(): return None
+    return int(date[:4])
+
+if __name__ == "__main__":
+    # Quick tests
+    for result in MusicBrainzAPI.search("Martin Garrix - Scared to be Lonely"):
+        print(result)
@@ -0,0 +1,131 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+
+import requests
+
+from music_tagger import colors as Color
+from music_tagger.metrics import METRICS
+from music_tagger.output import log, warn
+
+class TimeoutSession(requests.Session):
+    """Session that never waits forever, requests can still pass their own timeout"""
+    def __init__(self, timeout: float | tuple[float, float] = (5, 30)):
+        super().__init__()
+        self.timeout = timeout # (connect, read) seconds
+
+    def request(self, *args, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(*args, **kwargs)
+
+# Shared between all providers, so connections and cookies stay warm between files
+SESSION = TimeoutSession()
+
+def get(url: str, params: dict = None, **kwargs) -> requests.Response:
+    METRICS.count("requests")
+    # Sessions passed in by library users may not have a timeout of their own
+    if not isinstance(SESSION, TimeoutSession): kwargs.setdefault("timeout", (5, 30))
+    return SESSION.get(url, params = params, **kwargs)
+
+def paginate(search, query: str, limit: int, pages: int, max_limit: int):
+    """Yields pages of search results lazily, each twice as big as the one before, until the results run out"""
+    offset = 0
+    for _ in range(pages):
+        results = search(query, limit = limit, offset = offset)
+        yield results
+        if len(results) < limit: return
+        offset += limit
+        limit = min(limit * 2, max_limit)
+
+__HEDGE_EXECUTOR = ThreadPoolExecutor(16, thread_name_prefix = "hedge")
+__MIN_HEDGE_DELAY = 0.5
+__DEFAULT_HEDGE_DELAY = 2
+
+def hedged(function, *args, name: str, **kwargs):
+    """Calls function, and once more if it's slower than usual (p95), returning whichever answers first"""
+    def timed():
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        METRICS.observe(name, time.perf_counter() - start)
+        return result
+
+    p95 = METRICS.percentile(name, 0.95)
+    delay = max(p95, __MIN_HEDGE_DELAY) if p95 else __DEFAULT_HEDGE_DELAY
+
+    first = __HEDGE_EXECUTOR.submit(timed)
+    done, _ = wait([first], timeout = delay)
+    if done: return first.result()
+
+    METRICS.count(f"{name} hedged")
+    second = __HEDGE_EXECUTOR.submit(timed)
+    done, pending = wait([first, second], return_when = FIRST_COMPLETED)
+    for future in done:
+        if not future.exception(): return future.result()
+    if pending: return pending.pop().result()
+    return done.pop().result()
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Stops calling a failing provider for a while, then lets a single call through to probe it"""
+    def __init__(self, name: str, failures: int = 5, cooldown: float = 60):
+        self.name = name
+        self.__threshold = failures
+        self.__cooldown = cooldown
+        self.__failures = 0
+        self.__opened = None
+        self.__probing = False
+        self.__lock = Lock()
+
+    def is_open(self) -> bool:
+        return self.__opened is not None
+
+    def call(self, function, *args, **kwargs):
+        with self.__lock:
+            if self.__opened is not None:
+                remaining = self.__cooldown - (time.monotonic() - self.__opened)
+                if remaining > 0 or self.__probing:
+                    METRICS.count(f"{self.name} rejected")
+                    raise CircuitOpenError(f"{self.name} is failing, trying again in {max(remaining, 0):.0f}s")
+                self.__probing = True
+
+        try: result = function(*args, **kwargs)
+        except Exception as e:
+            self.__failed(e)
+            raise
+        with self.__lock:
+            if self.__opened is not None: log(f"{Color.OKGREEN}{self.name} is back{Color.ENDC}")
+            self.__failures = 0
+            self.__opened = None
+            self.__probing = False
+        return result
+
+    def __failed(self, error: Exception):
+        # Bad requests say nothing about the provider's health
+        response = getattr(error, "response", None)
+        if response is not None and response.status_code < 500 and response.status_code != 429: error = None
+
+        with self.__lock:
+            if not error:
+                self.__probing = False
+                return
+            self.__failures += 1
+            if self.__probing or self.__failures >= self.__threshold:
+                if not self.__probing: warn(f"{Color.WARNING}{Color.BOLD}{self.name} is failing,{Color.ENDC} pausing it for {self.__cooldown:.0f}s: {error}")
+                METRICS.count(f"{self.name} opened")
+                self.__opened = time.monotonic()
+                self.__probing = False
+
+__BREAKERS = {}
+__BREAKERS_LOCK = Lock()
+
+def breaker(name: str) -> CircuitBreaker:
+    """The circuit breaker of a provider"""
+    with __BREAKERS_LOCK:
+        if name not in __BREAKERS: __BREAKERS[name] = CircuitBreaker(name)
+        return __BREAKERS[name]
+
+def reset_breakers():
+    """Closes every circuit breaker, forgetting past failures"""
+    with __BREAKERS_LOCK: __BREAKERS.clear()
@@ -0,0 +1,49 @@
+import os, re, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from music_tagger import colors as Color
+from music_tagger.metadata import MetadataParser, embed_metadata, read_metadata
+
+BATCH = 256 # files per task, so the pool isn't busy passing messages
+__TRACK_NUMBER_REGEX = re.compile(r"^\d{1,2}\s*[-.]\s+") # "01 - Title", which isn't an artist
+
+def tag_offline(paths: list[Path], no_overwrite: bool = False, simulate: bool = False, workers: int = None) -> dict:
+    """Tags files from their filenames and existing tags only, without any provider or Shazam.
+    Batches of files are parsed and written in a process pool, returns how many were tagged, unchanged and failed."""
+    paths = [str(path) for path in paths]
+    batches = [paths[i:i + BATCH] for i in range(0, len(paths), BATCH)]
+    totals = {"tagged": 0, "unchanged": 0, "failed": 0}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(tag_batch, batch, no_overwrite, simulate) for batch in batches]
+        for future in as_completed(futures):
+            for path, status, detail in future.result():
+                totals[status] += 1
+                if status == "failed": print(f"\n{Color.FAIL}{Color.BOLD}ERROR:{Color.ENDC} {Path(path).name}: {detail}")
+                elif simulate: print(f"\n{Color.BOLD}{Path(path).name}{Color.ENDC}\n" + "\n".join(f"    {tag:12} {value}" for tag, value in detail.items()))
+            done = sum(totals.values())
+            print(f"\r{done}/{len(paths)} files, {done / max(time.perf_counter() - start, 1e-6) * 60:.0f} per minute", end = '')
+    print()
+    return totals
+
+def tag_batch(paths: list[str], no_overwrite: bool, simulate: bool) -> list[tuple[str, str, object]]:
+    results = []
+    for path in paths:
+        try:
+            tags = parse(path)
+            if simulate: results.append((path, "tagged", tags))
+            elif embed_metadata(Path(path), no_overwrite, verbose = False, **tags): results.append((path, "tagged", None))
+            else: results.append((path, "unchanged", None))
+        except Exception as e:
+            results.append((path, "failed", str(e)))
+    return results
+
+def parse(path: str) -> dict:
+    """The tags missing from the file, parsed from its existing artist and title, or from the filename.
+    Tags already in the file are trusted and never replaced by guesses."""
+    existing = read_metadata(Path(path)) or {}
+    if existing.get("artist") and existing.get("title"): name = f"{existing['artist']} - {existing['title']}"
+    else: name = __TRACK_NUMBER_REGEX.sub("", os.path.splitext(os.path.basename(path))[0])
+    return {tag: value for tag, value in MetadataParser(name).get_metadata_dict().items() if not existing.get(tag)}
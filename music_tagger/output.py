@@ -0,0 +1,31 @@
+import logging, re, sys
+
+# What tagging reports goes to the music_tagger logger. The command line prints it with colors,
+# library users get it without colors, and only when they configure logging.
+LOGGER = logging.getLogger("music_tagger")
+LOGGER.addHandler(logging.NullHandler())
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return getattr(record, "colored", record.getMessage())
+
+def log(*values, level: int = logging.INFO):
+    message = " ".join(str(value) for value in values)
+    LOGGER.log(level, strip_colors(message).strip(), extra = {"colored": message})
+
+def warn(*values):
+    log(*values, level = logging.WARNING)
+
+def error(*values):
+    log(*values, level = logging.ERROR)
+
+def to_console():
+    """Prints everything logged to stdout, as the command line does"""
+    if any(isinstance(handler.formatter, ConsoleFormatter) for handler in LOGGER.handlers): return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(ConsoleFormatter())
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
+
+def strip_colors(string: str) -> str:
+    return re.sub(r"\033\[[0-9;]*m", "", string)
@@ -0,0 +1,125 @@
+import json, os, socketserver, time
+from argparse import Namespace
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock
+
+from music_tagger.metrics import METRICS
+from music_tagger.output import strip_colors
+from music_tagger.walker import walk
+
+class JobServer:
+    """Runs tagging jobs on a shared worker pool, so provider tokens and sessions stay warm"""
+    def __init__(self, defaults: Namespace, workers: int = 4):
+        self.defaults = defaults
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix = "tagger")
+        self.__finished = deque(maxlen = 10000)
+        self.__lock = Lock()
+
+    def create_args(self, options: dict = None) -> Namespace:
+        """The server defaults with the options of a batch applied, raises TypeError or ValueError for invalid options"""
+        from music_tagger.library import create_args
+        return create_args(options, self.defaults)
+
+    def submit(self, paths: list[str], args: Namespace):
+        """Queues a batch and yields a result for each file as soon as it is done"""
+        files = [file for path in paths for file in walk(Path(path), args.include, args.exclude)]
+        METRICS.count("queued", len(files))
+        futures = {self.executor.submit(self.__run, file, args): file for file in files}
+        for future in as_completed(futures):
+            yield future.result()
+
+    def __run(self, path: Path, args: Namespace) -> dict:
+        from music_tagger import tag_music
+
+        METRICS.count("started")
+        start = time.perf_counter()
+        result = {"path": str(path)}
+        try:
+            file = tag_music(path, args)
+            result.update(describe(file))
+        except Exception as e:
+            result.update(status = "error", error = str(e))
+        result["seconds"] = time.perf_counter() - start
+
+        METRICS.count("finished")
+        METRICS.count(result.get("status"))
+        with self.__lock: self.__finished.append(time.time())
+        return result
+
+    def get_metrics(self) -> dict:
+        now = time.time()
+        with self.__lock:
+            last_minute = sum(1 for finished in self.__finished if now - finished <= 60)
+        return {
+            "queue_depth": METRICS.get("queued") - METRICS.get("started"),
+            "in_flight": METRICS.get("started") - METRICS.get("finished"),
+            "throughput": last_minute, # files per minute
+            **METRICS.snapshot(),
+        }
+
+def describe(file) -> dict:
+    if not file: return {"status": "skipped"}
+    result = {"output": str(file.path), "status": "identified" if file.identity else "unmatched"}
+    if file.identity:
+        result["match"] = strip_colors(repr(file.identity))
+        result["ratio"] = file.ratio
+    if file.error: result["error"] = file.error
+    return result
+
+class JobHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "music-tagger"
+
+    def do_GET(self):
+        if self.path != "/metrics": return self.__send_json(404, {"error": "Not found"})
+        self.__send_json(200, self.server.jobs.get_metrics())
+
+    def do_POST(self):
+        if self.path != "/jobs": return self.__send_json(404, {"error": "Not found"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            paths = body["paths"]
+            if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths): raise TypeError("paths must be a list of strings")
+            args = self.server.jobs.create_args(body.get("options"))
+        except (ValueError, KeyError, TypeError) as e:
+            return self.__send_json(400, {"error": f"Expected {{\"paths\": [...]}}: {e}"})
+
+        # Stream one JSON line per file
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for result in self.server.jobs.submit(paths, args):
+            self.__write_chunk(json.dumps(result).encode() + b"\n")
+        self.__write_chunk(b"")
+
+    def address_string(self) -> str:
+        # Unix sockets have no client address
+        return self.client_address[0] if self.client_address else "local"
+
+    def __write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def __send_json(self, status: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address): os.remove(self.server_address)
+        super().server_bind()
+
+def create_server(jobs: JobServer, host: str = "127.0.0.1", port: int = 8765, socket: str = None):
+    server = UnixHTTPServer(socket, JobHandler) if socket else ThreadingHTTPServer((host, port), JobHandler)
+    server.jobs = jobs
+    return server
@@ -1,10 +1,13 @@
 from music_tagger import colors as Color
+from music_tagger import network
+from music_tagger.memo import memoized, remember
 from music_tagger.spotify import SpotifyAPI, SpotifyTrack
 
 class ShazamTrack:
     def __init__(self, data: dict) -> None:
         if not data.get("isrc"): data = data.get("track")
 
+        self.__id = data.get("key")
         self.__isrc = data.get("isrc")
         self.__artwork = data.get("images").get("coverarthq").replace("400x400", "800x800")
         self.__genre = data.get("genres").get("primary")
@@ -13,11 +16,12 @@ class ShazamTrack:
         self.__artist = data.get("subtitle")
         self.__metadata = {}
 
-        self.__spotify = None
-
         for json in data.get("sections")[0].get("metadata"):
             self.__metadata[json.get("title").lower()] = json.get("text")
 
+    def get_id(self) -> str:
+        return self.__id
+
     def get_artwork(self) -> str:
         return self.__artwork
 
@@ -27,6 +31,9 @@ class ShazamTrack:
     def get_artist(self) -> str:
         return self.__artist
     
+    def get_album_artist(self) -> str:
+        return self.__artist
+
     def get_album(self) -> str:
         if self.__metadata.get("album"):
             return self.__metadata.get("album")
@@ -44,6 +51,9 @@ class ShazamTrack:
     def get_isrc(self) -> int:
         return self.__isrc
 
+    def is_explicit(self) -> bool | None:
+        return None
+
     def get_url(self) -> str:
         return self.__url
 
@@ -59,14 +69,21 @@ class ShazamTrack:
         if self.get_title().lower() in self.get_album().lower(): return "Single"
         return "Album"
 
-    def get_spotify_metadata(self, matches: list[SpotifyTrack] = []) -> SpotifyTrack | None:
-        if self.__spotify: return self.__spotify
+    @memoized("Shazam Spotify metadata")
+    def get_spotify_metadata(self) -> SpotifyTrack | None:
         if not self.__isrc: return
-        if not matches: matches = SpotifyAPI.search(isrc=self.__isrc, limit = 10)
-
-        for match in filter(lambda match: match.get_isrc() == self.__isrc, matches):
+        results = network.breaker(SpotifyAPI.NAME).call(SpotifyAPI.search, isrc = self.__isrc, limit = 10)
+        for match in filter(lambda match: match.get_isrc() == self.__isrc, results):
             return match
 
+    def find_spotify_metadata(self, matches: list) -> SpotifyTrack | None:
+        """Takes the Spotify track from results found already, if they have it, instead of searching"""
+        for match in matches:
+            if isinstance(match, SpotifyTrack) and self.__isrc and match.get_isrc() == self.__isrc:
+                remember(self, "Shazam Spotify metadata", match)
+                return match
+        return self.get_spotify_metadata()
+
     def to_string(self) -> str:
         return f"{self.get_artist()} - {self.get_title()} - {self.get_album()}"
 
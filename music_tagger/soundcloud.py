@@ -2,28 +2,23 @@ import json
 import re
 from os.path import join
 from pathlib import Path
-from ssl import SSLContext
 from urllib.parse import urljoin
-from urllib.request import urlopen
 
-import requests
 from bs4 import BeautifulSoup
 
 from music_tagger import colors as Color
+from music_tagger import network
+from music_tagger.memo import memoized
 from music_tagger.util import FOLDER
 from music_tagger.metadata import MetadataParser
 from music_tagger.spotify import SpotifyAPI, SpotifyTrack
 
 ssl_verify=True
 
-def get_ssl_setting():
-    if ssl_verify:
-        return None
-    else:
-        return SSLContext()
-
 def get_url(url):
-    return urlopen(url,context=get_ssl_setting()).read()
+    response = network.get(url, verify = ssl_verify)
+    response.raise_for_status()
+    return response.content
 
 def get_page(url):
     return get_url(url).decode('utf-8')
@@ -39,6 +34,7 @@ class SoundCloudAPI:
     __KEY_FILE = Path(join(FOLDER, "soundcloud.key"))
     WEBURL_BASE = "https://soundcloud.com"
     __API_BASE = "https://api-v2.soundcloud.com"
+    __MAX_LIMIT = 200
 
     __client_id = None
 
@@ -54,6 +50,7 @@ class SoundCloudAPI:
                 return SoundCloudAPI.__client_id
 
         # Fetch client_id
+        SoundCloudAPI.__client_id = None
         page_text = get_page(SoundCloudAPI.WEBURL_BASE)
         script_urls = SoundCloudAPI.__find_script_urls(page_text)
         for script in script_urls:
@@ -88,7 +85,7 @@ class SoundCloudAPI:
             return False
 
     @staticmethod
-    def search(query: str = "", limit: int = 5, offset: int = 0, tries = 10) -> list:
+    def search(query: str = "", limit: int = 5, offset: int = 0, tries = 1) -> list:
         url = "search/tracks"
 
         params = {
@@ -98,13 +95,35 @@ class SoundCloudAPI:
             "client_id": SoundCloudAPI.get_client_id()
         }
 
-        response = requests.get(urljoin(SoundCloudAPI.__API_BASE, url), params)
-        if response.status_code != 200:
-            if not tries: response.raise_for_status()
+        response = network.get(urljoin(SoundCloudAPI.__API_BASE, url), params)
+        # A long running process may outlive its client_id, other errors are left to the circuit breaker
+        if response.status_code in [401, 403] and tries:
+            SoundCloudAPI.get_client_id(refresh = True)
             return SoundCloudAPI.search(query, limit, offset, tries - 1)
-    
+        response.raise_for_status()
+
         return [SoundCloudTrack(result) for result in response.json().get("collection")]
 
+    @staticmethod
+    def search_iter(query: str = "", limit: int = 5, pages: int = 3, search = None):
+        """Yields pages of results, only requesting the next one when asked for it.
+        search replaces SoundCloudAPI.search for each page, e.g. to wrap it in a circuit breaker"""
+        return network.paginate(search or SoundCloudAPI.search, query, limit, pages, SoundCloudAPI.__MAX_LIMIT)
+
+    @staticmethod
+    def get_tracks(ids: list[str], tries = 1) -> list:
+        """Fetches tracks by id, 50 per request"""
+        results = []
+        for i in range(0, len(ids), 50):
+            params = {"ids": ",".join(ids[i:i + 50]), "client_id": SoundCloudAPI.get_client_id()}
+            response = network.get(urljoin(SoundCloudAPI.__API_BASE, "tracks"), params)
+            if response.status_code in [401, 403] and tries:
+                SoundCloudAPI.get_client_id(refresh = True)
+                return results + SoundCloudAPI.get_tracks(ids[i:], tries - 1)
+            response.raise_for_status()
+            results += [SoundCloudTrack(result) for result in response.json()]
+        return results
+
 class SoundCloudTrack:
     def __init__(self, data: dict):
         self.__artwork_url = data.get("artwork_url")
@@ -123,6 +142,9 @@ class SoundCloudTrack:
         self.__publisher_metadata = data.get("publisher_metadata")
         self.__metadata_parser = MetadataParser(self.__title)
 
+    def get_id(self) -> str:
+        return str(self.__id)
+
     def get_title(self) -> str:
         # if self.__publisher_metadata:
         #     title = self.__publisher_metadata.get("release_title")
@@ -190,9 +212,10 @@ class SoundCloudTrack:
     def get_url(self) -> str:
         return self.__url
 
+    @memoized("SoundCloud Spotify metadata")
     def get_spotify_metadata(self) -> SpotifyTrack | None:
         if self.__publisher_metadata and self.__publisher_metadata.get("isrc"):
-            try: return SpotifyAPI.search(isrc = self.__publisher_metadata.get("isrc"))[0]
+            try: return network.breaker(SpotifyAPI.NAME).call(SpotifyAPI.search, isrc = self.__publisher_metadata.get("isrc"))[0]
             except IndexError: return None
 
     def to_string(self) -> str:
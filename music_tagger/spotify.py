@@ -1,28 +1,44 @@
-import json, re, requests
+import json, re, sqlite3, time
+from os.path import join
+from pathlib import Path
+from threading import Event, Lock
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 
 from music_tagger import colors as Color
-from music_tagger import util
+from music_tagger import network, util
+from music_tagger.memo import memoized, remember
 from music_tagger.metadata import MetadataParser
+from music_tagger.metrics import METRICS
+from music_tagger.output import warn
+from music_tagger.util import FOLDER
 
 class SpotifyAPI:
     NAME = "Spotify"
     WEBURL_BASE = "http://open.spotify.com"
     API_BASE = "http://api.spotify.com"
     __HTML_PARSER = "html.parser"
+    __MAX_LIMIT = 50
 
     __access_token = None
+    __expires = 0
 
     @staticmethod
     def get_access_token() -> str:
-        if SpotifyAPI.__access_token: return SpotifyAPI.__access_token
-        response = requests.get(SpotifyAPI.WEBURL_BASE)
+        if SpotifyAPI.__access_token and time.time() < SpotifyAPI.__expires:
+            return SpotifyAPI.__access_token
+        response = network.get(SpotifyAPI.WEBURL_BASE)
         if response.status_code != 200:
             raise ValueError(f"get_access_token: {response.status_code}")
         soup = BeautifulSoup(response.content, SpotifyAPI.__HTML_PARSER)
         credentials = json.loads(soup.find(id="session").get_text())
         SpotifyAPI.__access_token = credentials.get("accessToken")
+
+        # Refresh a minute early, the token lives for about an hour
+        expires = credentials.get("accessTokenExpirationTimestampMs")
+        SpotifyAPI.__expires = expires / 1000 - 60 if expires else time.time() + 3000
+        # Already expired on arrival means the local clock is off (or the page is a recording)
+        if SpotifyAPI.__expires <= time.time(): SpotifyAPI.__expires = time.time() + 3000
         return SpotifyAPI.__access_token
 
     @staticmethod
@@ -42,15 +58,56 @@ class SpotifyAPI:
 
         headers = {"authorization": f"Bearer {SpotifyAPI.get_access_token()}"}
         
-        response = requests.get(urljoin(SpotifyAPI.API_BASE, url), params, headers = headers)
+        response = network.get(urljoin(SpotifyAPI.API_BASE, url), params, headers = headers)
         response.raise_for_status()
         return [SpotifyTrack(result) for result in response.json().get("tracks").get("items")]
 
+    @staticmethod
+    def search_iter(query: str = "", limit: int = 5, pages: int = 3, search = None):
+        """Yields pages of results, only requesting the next one when asked for it.
+        search replaces SpotifyAPI.search for each page, e.g. to wrap it in a circuit breaker"""
+        return network.paginate(search or SpotifyAPI.search, query, limit, pages, SpotifyAPI.__MAX_LIMIT)
+
+    @staticmethod
+    def get_tracks(ids: list[str]) -> list:
+        """Fetches tracks by id, 50 per request, with their full albums and audio features"""
+        tracks = SpotifyAPI.__get_all("/v1/tracks", "tracks", ids, 50)
+        albums = SpotifyAPI.__get_all("/v1/albums", "albums", list(dict.fromkeys(track["album"]["id"] for track in tracks)), 20)
+        albums = {album["id"]: album for album in albums}
+        features = SpotifyAPI.__get_all("/v1/audio-features", "audio_features", [track["id"] for track in tracks], 100)
+        features = {data["id"]: SpotifyAudioFeatures(data) for data in features}
+
+        results = []
+        for data in tracks:
+            track = SpotifyTrack({**data, "album": albums.get(data["album"]["id"], data["album"])})
+            if data["id"] in features: track.set_audio_features(features[data["id"]])
+            results.append(track)
+
+        # Genres of every artist at once, instead of one request per track later
+        SpotifyArtists.resolve([artist["id"] for data in tracks for artist in data["artists"] + data["album"]["artists"]])
+        return results
+
+    @staticmethod
+    def get_artists(ids: list[str]) -> list[dict]:
+        """Fetches full artists by id, 50 per request"""
+        return SpotifyAPI.__get_all("/v1/artists", "artists", ids, 50)
+
+    @staticmethod
+    def __get_all(url: str, key: str, ids: list[str], limit: int) -> list[dict]:
+        """Calls a multi-id endpoint in chunks of at most limit ids, skipping unknown ids"""
+        results = []
+        for i in range(0, len(ids), limit):
+            headers = {"authorization": f"Bearer {SpotifyAPI.get_access_token()}"}
+            response = network.get(urljoin(SpotifyAPI.API_BASE, url), {"ids": ",".join(ids[i:i + limit])}, headers = headers)
+            response.raise_for_status()
+            results += [result for result in response.json().get(key) if result]
+        return results
+
     @staticmethod
     def get_audio_features(id: str):
         url = f"/v1/audio-features/{id}"
         headers = {"authorization": f"Bearer {SpotifyAPI.get_access_token()}"}
-        response = requests.get(urljoin(SpotifyAPI.API_BASE, url), headers = headers)
+        response = network.get(urljoin(SpotifyAPI.API_BASE, url), headers = headers)
         response.raise_for_status()
         return SpotifyAudioFeatures(response.json())
 
@@ -59,7 +116,6 @@ class SpotifyTrack:
         self.__album = SpotifyAlbum(data.get("album"))
         self.__artists = [SpotifyArtist(artist) for artist in data.get("artists")]
         self.__explicit = data.get("explicit")
-        self.__features = None
         self.__id = data.get("id")
         self.__is_extended = None
         self.__isrc = data.get("external_ids").get("isrc")
@@ -74,6 +130,9 @@ class SpotifyTrack:
         self.__parse_brackets()
         self.__parse_dash()
 
+    def get_id(self) -> str:
+        return self.__id
+
     def get_api_url(self) -> str:
         return SpotifyAPI.API_BASE + "/v1/track/" + self.__id
 
@@ -126,10 +185,12 @@ class SpotifyTrack:
     def get_duration(self) -> int:
         return round(self.__duration / 1000)
 
+    @memoized("Spotify audio features")
     def __get_audio_features(self):
-        if self.__features: return self.__features
-        self.__features = SpotifyAPI.get_audio_features(self.__id)
-        return self.__features
+        return network.breaker(SpotifyAPI.NAME).call(SpotifyAPI.get_audio_features, self.__id)
+
+    def set_audio_features(self, features):
+        remember(self, "Spotify audio features", features)
 
     def is_explicit(self) -> bool | None:
         return self.__explicit
@@ -143,11 +204,17 @@ class SpotifyTrack:
     def get_musical_key(self) -> str | None:
         return self.__get_audio_features().get_musical_key()
 
+    @memoized("Spotify genre")
     def get_genre(self) -> str | None:
-        genres = self.__album.artists[0].genres
-        if genres: return genres[0]
+        # Search results only have simplified artists, without genres
+        artists = [artist.id for artist in self.__album.artists + self.__artists]
+        genres = network.breaker(SpotifyAPI.NAME).call(SpotifyArtists.get_genres, artists)
+        for artist in artists:
+            if genres.get(artist): return genres[artist][0]
+
+    def get_label(self) -> str | None:
+        return self.__album.label
 
-    def get_label(self): return None
     def get_spotify_metadata(self): return None
 
     def __parse_extended(self):
@@ -156,9 +223,10 @@ class SpotifyTrack:
 
     def __parse_brackets(self):
         for match in util.BRACKET_REGEX.findall(self.__name):
-            self.__parse_version(match)
+            keywords = util.KEYWORDS.scan(match)
+            if keywords.get("version"): self.__parse_version(match)
 
-            if util.FEAT_REGEX.search(match) or util.WITH_REGEX.search(match):
+            if keywords.get("featuring") or util.WITH_REGEX.search(match):
                 self.__name = self.__name.replace(match, "")
 
             # Clean up string
@@ -205,6 +273,7 @@ class SpotifyAlbum:
         self.artwork_url = data.get("images")[0].get("url")
         self.name = data.get("name")
         self.release_date = data.get("release_date")
+        self.label = data.get("label") # Only in full albums
         self.artists = [SpotifyArtist(artist) for artist in data.get("artists")]
 
     def get_api_url(self) -> str:
@@ -230,6 +299,8 @@ class SpotifyArtist:
         self.id = data.get("id")
         self.genres = data.get("genres")
         self.name = data.get("name")
+        if self.genres is not None: SpotifyArtists.put(self.id, self.genres)
+        elif self.id: SpotifyArtists.add(self.id)
 
     def get_api_url(self) -> str:
         return SpotifyAPI.API_BASE + "/v1/artist/" + self.id
@@ -246,6 +317,112 @@ class SpotifyArtist:
     def __repr__(self) -> str:
         return self.name
 
+class SpotifyArtists:
+    """Genres of Spotify artists, kept between runs.
+
+    Artists seen in any result are collected, and fetched 50 at a time once a genre
+    is needed, so genres cost about one request per 50 distinct artists."""
+    __DATABASE = Path(join(FOLDER, "artists.db"))
+    __MAX_AGE = 30 * 24 * 60 * 60 # genres change rarely
+    __LIMIT = 50
+
+    __connection = None
+    __lock = Lock()
+    __MAX_PENDING = 1000
+    __genres = {} # id -> genres, of this run
+    __pending = {} # ids seen but not fetched yet, oldest first
+    __fetching = {} # id -> Event, set when the request fetching it is done
+
+    @staticmethod
+    def connect() -> sqlite3.Connection:
+        if SpotifyArtists.__connection: return SpotifyArtists.__connection
+        SpotifyArtists.__DATABASE.parent.mkdir(parents = True, exist_ok = True)
+        connection = sqlite3.connect(SpotifyArtists.__DATABASE, check_same_thread = False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS artists (id TEXT PRIMARY KEY, genres TEXT, updated REAL)")
+        SpotifyArtists.__connection = connection
+        return connection
+
+    @staticmethod
+    def use(database: Path):
+        """Keeps the cache in another file from now on"""
+        with SpotifyArtists.__lock:
+            SpotifyArtists.__DATABASE = Path(database)
+            SpotifyArtists.__connection = None
+            SpotifyArtists.__genres = {}
+
+    @staticmethod
+    def add(id: str):
+        with SpotifyArtists.__lock:
+            if id in SpotifyArtists.__genres: return
+            SpotifyArtists.__pending[id] = None
+            if len(SpotifyArtists.__pending) > SpotifyArtists.__MAX_PENDING: SpotifyArtists.__pending.pop(next(iter(SpotifyArtists.__pending)))
+
+    @staticmethod
+    def put(id: str, genres: list[str]):
+        with SpotifyArtists.__lock:
+            SpotifyArtists.__store({id: genres})
+
+    @staticmethod
+    def get_genres(ids: list[str]) -> dict[str, list[str]]:
+        SpotifyArtists.resolve(ids)
+        return {id: SpotifyArtists.__genres.get(id, []) for id in ids}
+
+    @staticmethod
+    def resolve(ids: list[str]):
+        """Makes sure the genres of the ids are known, filling the requests up with pending ids.
+        The ids are claimed under the lock and fetched after releasing it, ids another thread is
+        fetching already are waited for instead."""
+        with SpotifyArtists.__lock:
+            ids = [id for id in dict.fromkeys(ids) if id and id not in SpotifyArtists.__genres]
+            if not ids: return
+            SpotifyArtists.__load(ids + list(SpotifyArtists.__pending))
+            ids = [id for id in ids if id not in SpotifyArtists.__genres]
+            waiting = set(SpotifyArtists.__fetching[id] for id in ids if id in SpotifyArtists.__fetching)
+            ids = [id for id in ids if id not in SpotifyArtists.__fetching]
+
+            # Pending ids ride along in the last request, which has room for them anyway
+            room = -len(ids) % SpotifyArtists.__LIMIT if ids else 0
+            ids += [id for id in SpotifyArtists.__pending if id not in ids and id not in SpotifyArtists.__fetching][:room]
+            done = Event()
+            for id in ids: SpotifyArtists.__fetching[id] = done
+
+        if ids:
+            try:
+                artists = SpotifyAPI.get_artists(ids)
+                METRICS.count("Spotify artists", len(ids))
+                genres = {id: [] for id in ids}
+                genres.update({artist["id"]: artist.get("genres") or [] for artist in artists})
+                with SpotifyArtists.__lock: SpotifyArtists.__store(genres)
+            finally:
+                with SpotifyArtists.__lock:
+                    for id in ids: SpotifyArtists.__fetching.pop(id, None)
+                done.set()
+        for event in waiting: event.wait()
+
+    @staticmethod
+    def __load(ids: list[str]):
+        connection = SpotifyArtists.connect()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = connection.execute(f"SELECT id, genres FROM artists WHERE updated > ? AND id IN ({', '.join('?' * len(chunk))})",
+                [time.time() - SpotifyArtists.__MAX_AGE] + chunk).fetchall()
+            for id, genres in rows:
+                SpotifyArtists.__genres[id] = json.loads(genres)
+                SpotifyArtists.__pending.pop(id, None)
+
+    @staticmethod
+    def __store(genres: dict[str, list[str]]):
+        for id in genres:
+            SpotifyArtists.__genres[id] = genres[id]
+            SpotifyArtists.__pending.pop(id, None)
+        try:
+            with SpotifyArtists.connect() as connection:
+                connection.executemany("INSERT OR REPLACE INTO artists VALUES (?, ?, ?)",
+                    [(id, json.dumps(value), time.time()) for id, value in genres.items()])
+        except sqlite3.Error as e:
+            warn(f"{Color.WARNING}{Color.BOLD}ARTIST CACHE ERROR:{Color.ENDC} {e}")
+
 class SpotifyAudioFeatures:
     __PITCH_CLASS = [
         "C",  # 0
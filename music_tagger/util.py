@@ -1,5 +1,7 @@
-import re
-from os.path import join, expanduser
+import json, re
+from os.path import isfile, join, expanduser
+
+from music_tagger.keywords import KeywordTrie
 
 FOLDER = join(expanduser('~'), ".music-tagger")
 
@@ -10,9 +12,6 @@ AUDIO_FORMATS = [
 ]
 
 # REGEXES
-def __list_to_regex(list: list) -> re.Pattern:
-    return re.compile(r"\b(" + r"|".join(list) + r")\b", re.I)
-
 __GENRES = [
     "Acid Jazz",
     "Acid Punk",
@@ -137,8 +136,23 @@ DASH_SPLITTER_REGEX = re.compile(r"(?:^|\s+)[-–—](?:\s+|$)")
 WITH_REGEX = re.compile(r"\b(with)\b", re.I)
 YEAR_REGEX = re.compile(r"\b(2[01k]\d{2})\b")
 
-EXTENDED_REGEX = __list_to_regex(__EXTENDED)
-FEAT_REGEX = __list_to_regex(__FEATURING)
-GENRE_REGEX = __list_to_regex(__GENRES)
-IGNORE_REGEX = __list_to_regex(__IGNORE)
-VERSION_REGEX = __list_to_regex(__VERSIONS)
\ No newline at end of file
+KEYWORDS = KeywordTrie({
+    "extended": __EXTENDED,
+    "featuring": __FEATURING,
+    "genre": __GENRES,
+    "ignore": __IGNORE,
+    "version": __VERSIONS,
+})
+
+# Extra keywords, e.g. {"genre": ["Amapiano"], "ignore": ["Premiere"]}
+__KEYWORDS_FILE = join(FOLDER, "keywords.json")
+if isfile(__KEYWORDS_FILE):
+    with open(__KEYWORDS_FILE) as file:
+        for category, words in json.load(file).items():
+            KEYWORDS.add(category, words)
+
+EXTENDED_REGEX = KEYWORDS.pattern("extended")
+FEAT_REGEX = KEYWORDS.pattern("featuring")
+GENRE_REGEX = KEYWORDS.pattern("genre")
+IGNORE_REGEX = KEYWORDS.pattern("ignore")
+VERSION_REGEX = KEYWORDS.pattern("version")
\ No newline at end of file
@@ -0,0 +1,82 @@
+import os, time
+from fnmatch import fnmatch
+from pathlib import Path
+from threading import Thread
+
+from music_tagger import colors as Color
+from music_tagger.util import AUDIO_FORMATS
+
+def walk(path: Path, include: list[str] = [], exclude: list[str] = [], follow_symlinks: bool = True):
+    """Yields audio files in directory order without recursion, skipping symlink loops"""
+    path = Path(path)
+    if not path.is_dir():
+        if is_music(path.name, path.name, include, exclude): yield path
+        return
+
+    visited = set()
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        try:
+            stat = directory.stat()
+            if (stat.st_dev, stat.st_ino) in visited: continue
+            visited.add((stat.st_dev, stat.st_ino))
+            entries = os.scandir(directory)
+        except OSError: continue
+
+        # Listed before yielding, so files renamed by the caller aren't seen twice
+        files, subdirectories = [], []
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks = follow_symlinks):
+                        subdirectories.append(Path(entry.path))
+                        continue
+                except OSError: continue
+
+                relative = os.path.relpath(entry.path, path)
+                if is_music(entry.name, relative, include, exclude): files.append(Path(entry.path))
+        yield from files
+
+        # Reversed, so subdirectories are visited in the order they were listed
+        stack.extend(reversed([directory for directory in subdirectories
+            if not any(fnmatch(os.path.relpath(directory, path), pattern) or fnmatch(directory.name, pattern) for pattern in exclude)]))
+
+def is_music(name: str, relative: str, include: list[str] = [], exclude: list[str] = []) -> bool:
+    if os.path.splitext(name)[1].lower() not in AUDIO_FORMATS: return False
+    if include and not any(fnmatch(relative, pattern) or fnmatch(name, pattern) for pattern in include): return False
+    return not any(fnmatch(relative, pattern) or fnmatch(name, pattern) for pattern in exclude)
+
+class Progress:
+    """Shows progress and ETA while the total is counted in the background"""
+    def __init__(self, path: Path, include: list[str] = [], exclude: list[str] = []):
+        self.total = None
+        self.done = 0
+        self.__start = time.monotonic()
+        Thread(target = self.__count, args = (path, include, exclude), daemon = True).start()
+
+    def __count(self, path: Path, include: list[str], exclude: list[str]):
+        self.total = sum(1 for _ in walk(path, include, exclude))
+
+    def step(self):
+        self.done += 1
+        print(f"\n{Color.OKCYAN}{self}{Color.ENDC}", end = '')
+
+    def get_eta(self) -> float | None:
+        if not self.total or self.done <= 1: return None
+        elapsed = time.monotonic() - self.__start
+        return elapsed / (self.done - 1) * (self.total - self.done + 1)
+
+    def __repr__(self) -> str:
+        if self.total is None: return f"[{self.done}/?]"
+        ret = f"[{self.done}/{self.total} {self.done / max(self.total, 1):.0%}]"
+        eta = self.get_eta()
+        if eta is not None: ret += f" ETA {format_duration(eta)}"
+        return ret
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours: return f"{hours}h{minutes:02}m"
+    if minutes: return f"{minutes}m{seconds:02}s"
+    return f"{seconds}s"
@@ -0,0 +1,128 @@
+import ctypes, ctypes.util, os, select, struct, sys, time
+from pathlib import Path
+
+from music_tagger.util import AUDIO_FORMATS
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class Watcher:
+    """Yields audio files appearing in a folder once they have stopped changing"""
+    def __init__(self, path: Path, debounce: float = 0.5, interval: float = 0.25, poll: bool = False):
+        self.path = Path(path)
+        self.debounce = debounce
+        self.interval = interval
+        self.__pending = {}  # path -> (size, mtime, last change)
+        self.__known = {}    # path -> (size, mtime) when last handed out
+        self.__inotify = None if poll else Inotify.create()
+        self.__directories = {}
+
+        if self.__inotify:
+            for directory in self.__walk_directories(self.path):
+                self.__add_watch(directory)
+
+    def is_native(self) -> bool:
+        return self.__inotify is not None
+
+    def mark_done(self, path: Path):
+        """Ignores future events for a file as long as it is unchanged, e.g. after tagging it"""
+        stat = self.__stat(path)
+        if stat: self.__known[path] = stat
+
+    def __iter__(self):
+        # Files already in the folder
+        for path in self.__scan():
+            self.__touch(path)
+
+        while True:
+            if self.__inotify: self.__read_events()
+            else:
+                time.sleep(self.interval)
+                for path in self.__scan(): self.__touch(path)
+            yield from self.__ready()
+
+    def __touch(self, path: Path):
+        stat = self.__stat(path)
+        if not stat or self.__known.get(path) == stat: return
+        previous = self.__pending.get(path)
+        if previous and previous[:2] == stat: return
+        self.__pending[path] = (*stat, time.monotonic())
+
+    def __ready(self):
+        now = time.monotonic()
+        for path, (size, mtime, changed) in list(self.__pending.items()):
+            if now - changed < self.debounce: continue
+            stat = self.__stat(path)
+            if stat != (size, mtime):
+                # Still being written
+                if stat: self.__pending[path] = (*stat, now)
+                else: self.__pending.pop(path)
+                continue
+            self.__pending.pop(path)
+            self.__known[path] = stat
+            yield path
+
+    def __read_events(self):
+        ready, _, _ = select.select([self.__inotify], [], [], self.interval)
+        if not ready: return
+        try: data = os.read(self.__inotify, 64 * 1024)
+        except BlockingIOError: return
+
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b"\0").decode(errors = "surrogateescape")
+            offset += INOTIFY_EVENT.size + length
+
+            directory = self.__directories.get(descriptor)
+            if not directory: continue
+            path = directory / name
+            if mask & IN_ISDIR:
+                for subdirectory in self.__walk_directories(path):
+                    self.__add_watch(subdirectory)
+                for file in self.__scan(path): self.__touch(file)
+            # Files are only complete once their writer has closed them
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and path.suffix.lower() in AUDIO_FORMATS:
+                self.__touch(path)
+
+    def __add_watch(self, directory: Path):
+        descriptor = Inotify.add_watch(self.__inotify, directory)
+        if descriptor >= 0: self.__directories[descriptor] = directory
+
+    def __scan(self, path: Path = None):
+        for root, _, files in os.walk(path or self.path):
+            for file in files:
+                if os.path.splitext(file)[1].lower() in AUDIO_FORMATS: yield Path(root, file)
+
+    @staticmethod
+    def __walk_directories(path: Path):
+        for root, _, _ in os.walk(path): yield Path(root)
+
+    @staticmethod
+    def __stat(path: Path) -> tuple[int, float] | None:
+        try: stat = path.stat()
+        except OSError: return None
+        return stat.st_size, stat.st_mtime
+
+class Inotify:
+    __libc = None
+
+    @staticmethod
+    def create() -> int | None:
+        """Returns an inotify file descriptor, or None where inotify isn't available"""
+        if not sys.platform.startswith("linux"): return None
+        try:
+            Inotify.__libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+            descriptor = Inotify.__libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError): return None
+        return descriptor if descriptor >= 0 else None
+
+    @staticmethod
+    def add_watch(descriptor: int, directory: Path) -> int:
+        return Inotify.__libc.inotify_add_watch(descriptor, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
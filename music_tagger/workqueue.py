@@ -0,0 +1,166 @@
+import json, os, socket, sqlite3, time
+from argparse import Namespace
+from multiprocessing import Process
+from pathlib import Path
+from threading import Event, Thread
+
+from music_tagger import colors as Color
+
+class WorkQueue:
+    """File queue shared by worker processes and hosts, claimed with expiring leases.
+
+    Uses SQLite's rollback journal instead of WAL, since WAL needs shared memory
+    and doesn't work on network filesystems.
+    """
+    MAX_ATTEMPTS = 3 # files failing this often are given up on
+
+    def __init__(self, filepath: Path):
+        self.filepath = Path(filepath)
+        self.filepath.parent.mkdir(parents = True, exist_ok = True)
+        self.__connection = sqlite3.connect(self.filepath, timeout = 60, isolation_level = None, check_same_thread = False)
+        self.__connection.row_factory = sqlite3.Row
+        self.__connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            path TEXT PRIMARY KEY,
+            status TEXT DEFAULT 'pending',
+            owner TEXT,
+            expires REAL,
+            attempts INTEGER DEFAULT 0,
+            started REAL,
+            finished REAL,
+            result TEXT)""")
+        self.__connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, expires)")
+
+    def enqueue(self, paths: list[Path]) -> int:
+        """Adds files that aren't queued yet, returns how many were added"""
+        with self.__transaction() as connection:
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO jobs (path) VALUES (?)", [(str(path),) for path in paths])
+            return connection.total_changes - before
+
+    def claim(self, owner: str, lease: float) -> str | None:
+        """Takes the next pending file, or one whose lease has run out"""
+        now = time.time()
+        with self.__transaction() as connection:
+            connection.execute("UPDATE jobs SET status = 'failed', owner = NULL WHERE status = 'running' AND expires < ? AND attempts >= ?",
+                (now, WorkQueue.MAX_ATTEMPTS))
+            row = connection.execute("""
+                UPDATE jobs SET status = 'running', owner = ?, expires = ?, attempts = attempts + 1, started = ?
+                WHERE path = (
+                    SELECT path FROM jobs
+                    WHERE status = 'pending' OR status = 'running' AND expires < ?
+                    ORDER BY status = 'running', rowid LIMIT 1)
+                RETURNING path""", (owner, now + lease, now, now)).fetchone()
+        return row["path"] if row else None
+
+    def renew(self, path: str, owner: str, lease: float) -> bool:
+        """Extends the lease, returns False if it was lost to another worker"""
+        with self.__transaction() as connection:
+            cursor = connection.execute("UPDATE jobs SET expires = ? WHERE path = ? AND owner = ? AND status = 'running'",
+                (time.time() + lease, path, owner))
+            return cursor.rowcount == 1
+
+    def complete(self, path: str, owner: str, result: dict) -> bool:
+        with self.__transaction() as connection:
+            cursor = connection.execute("""
+                UPDATE jobs SET status = 'done', owner = NULL, expires = NULL, finished = ?, result = ?
+                WHERE path = ? AND owner = ? AND status = 'running'""", (time.time(), json.dumps(result), path, owner))
+            return cursor.rowcount == 1
+
+    def release(self, path: str, owner: str):
+        """Gives a file back to the queue, e.g. when the worker is stopped"""
+        with self.__transaction() as connection:
+            connection.execute("UPDATE jobs SET status = 'pending', owner = NULL, expires = NULL, attempts = attempts - 1 WHERE path = ? AND owner = ?",
+                (path, owner))
+
+    def report(self) -> dict:
+        """Merges the results of every worker into one run report"""
+        rows = self.__connection.execute("SELECT * FROM jobs").fetchall()
+        report = {"total": len(rows), "statuses": {}, "results": {}, "workers": {}, "failed": []}
+        for row in rows:
+            report["statuses"][row["status"]] = report["statuses"].get(row["status"], 0) + 1
+            if row["status"] == "failed": report["failed"].append(row["path"])
+            if not row["result"]: continue
+
+            result = json.loads(row["result"])
+            status = result.get("status")
+            report["results"][status] = report["results"].get(status, 0) + 1
+            worker = report["workers"].setdefault(result.get("worker"), {"files": 0, "seconds": 0})
+            worker["files"] += 1
+            worker["seconds"] += result.get("seconds", 0)
+        return report
+
+    def __transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't claim the same file
+        return Transaction(self.__connection)
+
+class Transaction:
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, error_type, error, traceback):
+        self.connection.execute("ROLLBACK" if error_type else "COMMIT")
+
+def get_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def work(filepath: Path, args: Namespace, lease: float = 300):
+    """Tags files from the queue until it's empty"""
+    from music_tagger import tag_music
+    from music_tagger.output import to_console
+    from music_tagger.serve import describe
+
+    # Processes started with spawn don't inherit the output of the command line
+    to_console()
+    queue = WorkQueue(filepath)
+    heartbeat_queue = WorkQueue(filepath) # SQLite connections can't be shared between threads
+    owner = get_owner()
+    while path := queue.claim(owner, lease):
+        # Keep the lease while the file takes longer than it
+        done = Event()
+        heartbeat = Thread(target = renew, args = (heartbeat_queue, path, owner, lease, done), daemon = True)
+        heartbeat.start()
+
+        start = time.perf_counter()
+        result = {"worker": owner}
+        try: result.update(describe(tag_music(Path(path), args)))
+        except KeyboardInterrupt:
+            done.set()
+            queue.release(path, owner)
+            raise
+        except Exception as e: result.update(status = "error", error = str(e))
+        result["seconds"] = time.perf_counter() - start
+
+        done.set()
+        heartbeat.join()
+        if not queue.complete(path, owner, result):
+            print(f"{Color.WARNING}{Color.BOLD}LEASE LOST:{Color.ENDC} {path} was taken over by another worker")
+
+def renew(queue: WorkQueue, path: str, owner: str, lease: float, done: Event):
+    while not done.wait(lease / 3):
+        if not queue.renew(path, owner, lease): return
+
+def run_workers(filepath: Path, args: Namespace, processes: int = 1, lease: float = 300):
+    """Runs worker processes on this host, other hosts can run their own on the same queue"""
+    if processes <= 1: return work(filepath, args, lease)
+    workers = [Process(target = work, args = (filepath, args, lease)) for _ in range(processes)]
+    for worker in workers: worker.start()
+    for worker in workers: worker.join()
+
+def print_report(report: dict):
+    print(f"{Color.BOLD}{report['total']} files{Color.ENDC}")
+    for status, count in sorted(report["statuses"].items()):
+        print(f"    {status:12} {count}")
+    if report["results"]:
+        print(f"{Color.BOLD}Results{Color.ENDC}")
+        for status, count in sorted(report["results"].items()):
+            print(f"    {status:12} {count}")
+    if report["workers"]:
+        print(f"{Color.BOLD}Workers{Color.ENDC}")
+        for worker, stats in sorted(report["workers"].items(), key = lambda item: str(item[0])):
+            print(f"    {worker:30} {stats['files']} files, {stats['seconds'] / max(stats['files'], 1):.1f}s per file")
+    for path in report["failed"]:
+        print(f"{Color.FAIL}{Color.BOLD}FAILED:{Color.ENDC} {path}")
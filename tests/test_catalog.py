@@ -0,0 +1,98 @@
+import pytest
+
+from music_tagger.catalog import CatalogAPI, CatalogTrack, fts_query
+from music_tagger.shazam_track import ShazamTrack
+from music_tagger.soundcloud import SoundCloudTrack
+from music_tagger.spotify import SpotifyAPI
+
+def soundcloud_track(**data) -> SoundCloudTrack:
+    return SoundCloudTrack({
+        "id": 1,
+        "title": "Martin Garrix - Scared to be Lonely",
+        "duration": 220000,
+        "tag_list": "",
+        "created_at": "2017-01-27T00:00:00Z",
+        "permalink_url": "https://soundcloud.com/martingarrix/scared-to-be-lonely",
+        "user": {"username": "Martin Garrix", "avatar_url": None},
+        **data,
+    })
+
+class Track:
+    """A track without an album, like many on SoundCloud"""
+    def get_isrc(self): return None
+    def get_title(self): return "Scared to be Lonely"
+    def get_artist(self): return "Martin Garrix"
+    def get_album_artist(self): return None
+    def get_album(self): return None
+    def get_album_type(self): return "Single"
+    def get_duration(self): return 220
+    def get_artwork(self): return None
+    def get_genre(self): return None
+    def get_label(self): return None
+    def get_year(self): return 2017
+    def is_explicit(self): return None
+    def get_url(self): return "https://example.com/scared-to-be-lonely"
+    def get_id(self): return "1"
+
+def shazam_track() -> ShazamTrack:
+    return ShazamTrack({
+        "key": "1",
+        "isrc": "NLM5S1700001",
+        "title": "Scared to be Lonely",
+        "subtitle": "Martin Garrix & Dua Lipa",
+        "url": "https://www.shazam.com/track/1",
+        "images": {"coverarthq": "https://example.com/400x400.jpg"},
+        "genres": {"primary": "Dance"},
+        "sections": [{"metadata": [{"title": "Album", "text": "Scared to be Lonely"}, {"title": "Released", "text": "2017"}]}],
+    })
+
+@pytest.fixture(autouse = True)
+def catalog(tmp_path):
+    CatalogAPI.use(tmp_path / "catalog.db")
+    yield
+    CatalogAPI.use(tmp_path / "closed.db")
+
+def test_search_finds_added_tracks():
+    CatalogAPI.add_all([soundcloud_track()])
+    results = CatalogAPI.search("garrix scared lonely")
+    assert len(results) == 1
+    assert isinstance(results[0], CatalogTrack)
+    assert results[0].get_title() == "Scared to be Lonely"
+    assert results[0].get_duration() == 220
+    assert results[0].get_source() == "SoundCloud"
+
+def test_album_is_a_string_without_an_album():
+    CatalogAPI.add_all([Track()])
+    track = CatalogAPI.search("garrix scared lonely")[0]
+    assert track.get_album() == ""
+    assert track.get_artist() + " - " + track.get_title() + " " + track.get_album()
+
+def test_get_all_by_isrc():
+    CatalogAPI.add_all([soundcloud_track(publisher_metadata = {"isrc": "NLM5S1700001"})])
+    tracks = CatalogAPI.get_all(["NLM5S1700001", "XXX000000000"])
+    assert list(tracks) == ["NLM5S1700001"]
+    assert tracks["NLM5S1700001"].get_isrc() == "NLM5S1700001"
+
+def test_adding_does_not_search(monkeypatch):
+    def search(*args, **kwargs): raise AssertionError("searched Spotify")
+    monkeypatch.setattr(SpotifyAPI, "search", search)
+    CatalogAPI.add(shazam_track())
+    track = CatalogAPI.get("NLM5S1700001")
+    assert track.get_title() == "Scared to be Lonely"
+    assert track.get_duration() == 0
+
+def test_catalog_tracks_are_not_added_again():
+    CatalogAPI.add_all([soundcloud_track()])
+    CatalogAPI.add_all(CatalogAPI.search("garrix scared lonely"))
+    assert len(CatalogAPI.search("garrix scared lonely")) == 1
+
+def test_fts_query_ignores_short_words():
+    assert fts_query("a b") is None
+    assert set(fts_query("Dua Lipa - On").split(" AND ")) == {"\"dua\"", "\"lipa\""}
+
+def test_fts_query_ignores_versions():
+    assert set(fts_query("Dua Lipa (Extended Mix) [Free DL]").split(" AND ")) == {"\"dua\"", "\"lipa\""}
+
+def test_search_needs_every_word():
+    CatalogAPI.add_all([soundcloud_track(), soundcloud_track(id = 2, title = "Martin Garrix - Animals", permalink_url = "https://soundcloud.com/martingarrix/animals")])
+    assert [track.get_title() for track in CatalogAPI.search("Martin Garrix - Animals (Original Mix)")] == ["Animals"]
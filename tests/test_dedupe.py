@@ -0,0 +1,36 @@
+import sys
+from argparse import Namespace
+
+import music_tagger
+from music_tagger import fingerprint
+from tests.test_offline import mp3
+
+class Track:
+    def get_duration(self): return 1
+
+class File:
+    def __init__(self, match):
+        self.identity, self.ratio = match or (Track(), 0.9)
+
+def tag(monkeypatch) -> list:
+    tagged = []
+    def tag_music(path, args, match = None):
+        tagged.append((path.name, match))
+        return File(match)
+    monkeypatch.setattr(music_tagger, "tag_music", tag_music)
+    return tagged
+
+def test_duplicates_of_another_length_are_identified_on_their_own(tmp_path, monkeypatch):
+    paths = [mp3(tmp_path / "Radio Edit.mp3"), mp3(tmp_path / "Copy.mp3"), mp3(tmp_path / "Extended Mix.mp3", frames = 400)]
+    monkeypatch.setattr(fingerprint, "cluster", lambda paths: [paths])
+    tagged = tag(monkeypatch)
+
+    music_tagger.tag_clusters(paths, Namespace(analysis = "off"))
+    assert [name for name, match in tagged] == ["Radio Edit.mp3", "Copy.mp3", "Extended Mix.mp3"]
+    assert [match is not None for name, match in tagged] == [False, True, False]
+
+def test_without_numpy_files_are_tagged_on_their_own(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "music_tagger.fingerprint", None)
+    tagged = tag(monkeypatch)
+    music_tagger.tag_clusters([tmp_path / "a.mp3", tmp_path / "b.mp3"], Namespace(analysis = "off"))
+    assert tagged == [("a.mp3", None), ("b.mp3", None)]
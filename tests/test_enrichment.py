@@ -0,0 +1,42 @@
+from concurrent.futures import Future
+from pathlib import Path
+
+import pytest
+
+from music_tagger import enrichment
+from music_tagger.catalog import CatalogAPI
+from music_tagger.spotify import SpotifyAPI, SpotifyArtists, SpotifyAudioFeatures
+from tests.test_spotify import spotify_track
+
+analysis = pytest.importorskip("music_tagger.analysis")
+
+class Match:
+    def __init__(self, tempo = None): self.tempo = tempo
+    def get_tempo(self): return self.tempo
+
+def test_analysis_started_ahead_is_used(monkeypatch):
+    pending = Future()
+    pending.set_result({"tempo": 128, "key": 9, "mode": 0})
+    monkeypatch.setitem(vars(analysis)["__PENDING"], Path("track.mp3"), pending)
+    features = enrichment.get_audio_features(Match(), Path("track.mp3"), "fallback")
+    assert features.get_tempo() == 128
+    assert Path("track.mp3") not in vars(analysis)["__PENDING"]
+
+def test_analysis_is_dropped_when_the_match_has_features(monkeypatch):
+    pending = Future()
+    monkeypatch.setitem(vars(analysis)["__PENDING"], Path("track.mp3"), pending)
+    match = Match(128)
+    assert enrichment.get_audio_features(match, Path("track.mp3"), "fallback") is match
+    assert pending.cancelled()
+    assert enrichment.get_audio_features(Match(), Path("track.mp3"), "off") is None
+
+def test_record_tags_are_strings(tmp_path, monkeypatch):
+    CatalogAPI.use(tmp_path / "catalog.db")
+    SpotifyArtists.use(tmp_path / "artists.db")
+    monkeypatch.setattr(SpotifyAPI, "get_artists", lambda ids: [{"id": id, "genres": ["dance"]} for id in ids])
+    monkeypatch.setattr(SpotifyAPI, "get_audio_features", lambda id: SpotifyAudioFeatures({"tempo": 128, "key": 9, "mode": 0}))
+    monkeypatch.setattr(enrichment, "download", lambda url, provider: None)
+
+    record = enrichment.enrich(spotify_track(), Path("track.mp3"), "off")
+    assert record.albumartist == "Martin Garrix"
+    assert all(isinstance(value, (str, int, bool)) for value in record.get_tags().values() if value is not None)
@@ -0,0 +1,16 @@
+import logging
+
+from music_tagger.evaluation import isolated
+from music_tagger.output import LOGGER, log, to_console
+
+def test_matcher_output_is_silenced_while_evaluating(capsys):
+    level = LOGGER.level
+    to_console()
+    try:
+        with isolated(): log("Matching with Spotify...")
+        assert capsys.readouterr().out == ""
+        log("Done")
+        assert capsys.readouterr().out == "Done\n"
+    finally:
+        LOGGER.handlers = [handler for handler in LOGGER.handlers if isinstance(handler, logging.NullHandler)]
+        LOGGER.setLevel(level)
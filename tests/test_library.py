@@ -0,0 +1,29 @@
+import json
+from pathlib import Path
+
+from music_tagger import enrichment
+from music_tagger.catalog import CatalogAPI
+from music_tagger.library import create_args, tag_file
+from music_tagger.spotify import SpotifyAPI, SpotifyArtists, SpotifyAudioFeatures
+from tests.test_spotify import spotify_track
+
+class File:
+    path = Path("Martin Garrix - Scared to be Lonely.mp3")
+    identity = spotify_track()
+    ratio = 0.9
+    error = None
+    def enrich(self, analysis): return enrichment.enrich(self.identity, self.path, analysis)
+
+def test_spotify_results_are_json(tmp_path, monkeypatch):
+    CatalogAPI.use(tmp_path / "catalog.db")
+    SpotifyArtists.use(tmp_path / "artists.db")
+    monkeypatch.setattr(SpotifyAPI, "get_artists", lambda ids: [{"id": id, "genres": ["dance"]} for id in ids])
+    monkeypatch.setattr(SpotifyAPI, "get_audio_features", lambda id: SpotifyAudioFeatures({"tempo": 128, "key": 9, "mode": 0}))
+    monkeypatch.setattr(enrichment, "download", lambda url, provider: None)
+    monkeypatch.setattr("music_tagger.tag_music", lambda path, args: File())
+
+    result = tag_file(File.path, create_args({"analysis": "off"}))
+    assert result.status == "identified"
+    data = json.loads(json.dumps(result.to_dict()))
+    assert data["metadata"]["albumartist"] == "Martin Garrix"
+    assert data["metadata"]["bpm"] == 128
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import pytest
+
+from music_tagger import network
+from music_tagger.catalog import CatalogAPI
+from music_tagger.matcher import Matcher
+from music_tagger.musicbrainz import MusicBrainzAPI
+from music_tagger.spotify import SpotifyAPI
+
+class File:
+    metadata = None
+    path = Path("Martin Garrix - Scared to be Lonely.mp3")
+    def get_filename(self): return self.path.stem
+    def get_duration(self): return 220
+
+class Track:
+    def get_title(self): return "Scared to be Lonely"
+    def get_artist(self): return "Martin Garrix"
+    def get_album(self): return "Scared to be Lonely"
+    def get_duration(self): return 220
+    def get_album_type(self): return "Single"
+    def __getattr__(self, name): return lambda: None
+
+SHAZAM = {
+    "key": "1",
+    "isrc": "NLM5S1700001",
+    "title": "Scared to be Lonely",
+    "subtitle": "Martin Garrix",
+    "url": "https://www.shazam.com/track/1",
+    "images": {"coverarthq": "https://example.com/400x400.jpg"},
+    "genres": {"primary": "Dance"},
+    "sections": [{"metadata": []}],
+}
+
+@pytest.fixture(autouse = True)
+def catalog(tmp_path):
+    CatalogAPI.use(tmp_path / "catalog.db")
+    MusicBrainzAPI.use(tmp_path / "musicbrainz.db")
+    yield
+    network.reset_breakers()
+
+def test_shazam_is_left_out_without_spotify(monkeypatch):
+    def search(*args, **kwargs): raise network.CircuitOpenError("Spotify is down")
+    monkeypatch.setattr(SpotifyAPI, "search", search)
+    monkeypatch.setattr(Matcher, "recognize", lambda music_file, stop = None: SHAZAM)
+
+    track = Track()
+    match = Matcher.identify(File(), apis = [], suppress = True, deadline = None, ids = False, candidates = {track: 0.7})
+    assert match == (track, 0.7)
+
+def test_local_results_are_not_copied_to_the_catalog():
+    MusicBrainzAPI.import_dump(Path(__file__).parent / "fixtures" / "recording")
+    assert Matcher._Matcher__match(File(), MusicBrainzAPI)
+    assert CatalogAPI.search("Martin Garrix Scared to be Lonely") == []
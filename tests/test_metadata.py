@@ -0,0 +1,15 @@
+from music_tagger import util
+from music_tagger.metadata import MetadataParser
+
+def test_genres_and_years_are_stripped_from_artists():
+    parser = MetadataParser("Acid Jazz Bob & Pop Alice - Song 2k19")
+    assert parser.get_artist() == "Bob & Alice"
+    assert parser.year == "2019"
+
+def test_titles_are_scanned_for_genres_once(monkeypatch):
+    scans = []
+    scan = util.KEYWORDS.scan
+    monkeypatch.setattr(util.KEYWORDS, "scan", lambda text: scans.append(text) or scan(text))
+    parser = MetadataParser("Deep House Bob & Alice feat. Pop Carol - Song")
+    assert parser.get_artist() == "Bob, Alice & Carol"
+    assert scans == ["Deep House Bob & Alice feat. Pop Carol - Song"]
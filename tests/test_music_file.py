@@ -0,0 +1,11 @@
+from music_tagger.metadata import read_info, read_metadata
+from music_tagger.music_file import MusicFile
+
+def test_undecodable_files_read_as_untagged(tmp_path):
+    path = tmp_path / "Artist - Title.mp3"
+    path.write_bytes(b"\x00" * 3000)
+    assert read_metadata(path) is None
+    assert read_info(path) is None
+    file = MusicFile(path)
+    assert file.get_title() is None
+    assert str(file) == "Artist - Title"
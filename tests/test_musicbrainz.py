@@ -0,0 +1,63 @@
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from music_tagger.musicbrainz import MusicBrainzAPI, MusicBrainzTrack
+
+FIXTURE = Path(__file__).parent / "fixtures" / "recording"
+
+@pytest.fixture(autouse = True)
+def database(tmp_path):
+    MusicBrainzAPI.use(tmp_path / "musicbrainz.db")
+
+@pytest.fixture
+def imported():
+    return MusicBrainzAPI.import_dump(FIXTURE)
+
+def test_nothing_to_search_before_importing():
+    assert not MusicBrainzAPI.is_imported()
+    assert MusicBrainzAPI.search("Martin Garrix - Scared to Be Lonely") == []
+    assert MusicBrainzAPI.get("NLM5S1700001") == []
+
+def test_import_skips_recordings_without_title(imported):
+    assert imported == 3
+    assert MusicBrainzAPI.is_imported()
+
+def test_import_from_archive(tmp_path):
+    archive = tmp_path / "recording.tar.xz"
+    with tarfile.open(archive, "w:xz") as file: file.add(FIXTURE, "mbdump/recording")
+    assert MusicBrainzAPI.import_dump(archive) == 3
+
+def test_reimport_updates_recordings(imported):
+    MusicBrainzAPI.import_dump(FIXTURE)
+    assert len(MusicBrainzAPI.search("scared lonely", limit = 10)) == 2
+
+def test_search(imported):
+    results = MusicBrainzAPI.search("Martin Garrix - Scared to Be Lonely")
+    assert results and all(isinstance(track, MusicBrainzTrack) for track in results)
+    assert {track.get_title() for track in results} == {"Scared to Be Lonely"}
+    assert MusicBrainzAPI.search("Avicii Levels")[0].get_artist() == "Avicii"
+
+def test_prefers_the_official_single(imported):
+    track = MusicBrainzAPI.get_tracks(["0b1e4f5c-0000-4000-8000-000000000001"])[0]
+    assert track.get_artist() == "Martin Garrix & Dua Lipa"
+    assert track.get_album() == "Scared to Be Lonely"
+    assert track.get_album_type() == "Single"
+    assert track.get_label() == "STMPD RCRDS"
+    assert track.get_year() == 2017
+    assert track.get_duration() == 221
+    assert track.get_genre() == "Edm"
+    assert track.get_url() == "https://musicbrainz.org/recording/0b1e4f5c-0000-4000-8000-000000000001"
+
+def test_without_releases(imported):
+    track = MusicBrainzAPI.get("se1tv1100001")[0]
+    assert track.get_title() == "Levels"
+    assert track.get_album() == ""
+    assert track.get_album_type() is None
+    assert track.get_year() == 2011
+
+def test_get_every_recording_of_an_isrc(imported):
+    tracks = MusicBrainzAPI.get("NLM5S1700001")
+    assert sorted(track.get_id() for track in tracks) == ["0b1e4f5c-0000-4000-8000-000000000001", "0b1e4f5c-0000-4000-8000-000000000002"]
+    assert [track.get_album_type() for track in MusicBrainzAPI.get("NLM5S1700002")] == ["Album"]
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import pytest
+
+from music_tagger.metadata import create_id3, read_metadata
+from music_tagger.offline import parse, tag_batch
+
+def mp3(path: Path, frames: int = 40, **tags) -> Path:
+    """A silent mp3 with the given tags, 26 ms per frame"""
+    create_id3(path, **tags)
+    frame = b"\xff\xfb\x90\x00" + bytes(413) # MPEG-1 Layer III, 128 kbps, 44.1 kHz
+    with open(path, "ab") as file: file.write(frame * frames)
+    return path
+
+@pytest.fixture
+def tagged(tmp_path) -> Path:
+    return mp3(tmp_path / "01 - Real Title.mp3", artist = "Real Artist", title = "Real Title", album = "Real Album")
+
+def test_existing_tags_are_kept(tagged):
+    assert tag_batch([str(tagged)], False, False) == [(str(tagged), "tagged", None)]
+    tags = read_metadata(tagged)
+    assert (tags["artist"], tags["title"], tags["album"]) == ("Real Artist", "Real Title", "Real Album")
+    assert tags["albumartist"] == "Real Artist"
+
+def test_missing_tags_are_parsed_from_the_filename(tmp_path):
+    path = mp3(tmp_path / "Martin Garrix - Scared to be Lonely.mp3", title = "Scared to be Lonely")
+    assert parse(str(path)) == {"album": "Scared to be Lonely", "artist": "Martin Garrix", "albumartist": "Martin Garrix"}
+
+def test_track_numbers_are_not_artists(tmp_path):
+    path = mp3(tmp_path / "01 - Real Title.mp3")
+    assert "artist" not in parse(str(path))
@@ -0,0 +1,63 @@
+import time
+from threading import Thread
+
+import pytest
+
+from music_tagger.catalog import CatalogAPI
+from music_tagger.spotify import SpotifyAPI, SpotifyArtists, SpotifyTrack
+
+def spotify_track(id: str = "1", artist: str = "a1") -> SpotifyTrack:
+    return SpotifyTrack({
+        "id": id,
+        "name": "Scared to be Lonely",
+        "duration_ms": 220000,
+        "explicit": False,
+        "external_ids": {"isrc": f"NLM5S170000{id}"},
+        "artists": [{"id": artist, "name": "Martin Garrix"}],
+        "album": {
+            "id": "album",
+            "name": "Scared to be Lonely",
+            "album_type": "single",
+            "release_date": "2017-01-27",
+            "images": [{"url": "https://example.com/640.jpg"}],
+            "artists": [{"id": artist, "name": "Martin Garrix"}],
+        },
+    })
+
+@pytest.fixture(autouse = True)
+def caches(tmp_path):
+    CatalogAPI.use(tmp_path / "catalog.db")
+    SpotifyArtists.use(tmp_path / "artists.db")
+
+def test_saving_search_results_does_not_fetch_artists(monkeypatch):
+    def get_artists(ids): raise AssertionError("fetched artists")
+    monkeypatch.setattr(SpotifyAPI, "get_artists", get_artists)
+    CatalogAPI.add_all([spotify_track("1"), spotify_track("2", "a2")])
+    assert CatalogAPI.get("NLM5S1700001").get_genre() is None
+
+def test_genres_are_fetched_together_once(monkeypatch):
+    requests = []
+    def get_artists(ids):
+        requests.append(ids)
+        return [{"id": id, "genres": [f"genre {id}"]} for id in ids]
+    monkeypatch.setattr(SpotifyAPI, "get_artists", get_artists)
+
+    tracks = [spotify_track("1", "a1"), spotify_track("2", "a2")]
+    assert tracks[0].get_genre() == "genre a1"
+    assert tracks[1].get_genre() == "genre a2"
+    assert requests == [["a1", "a2"]]
+
+def test_fetching_does_not_block_other_threads(monkeypatch):
+    def get_artists(ids):
+        time.sleep(0.5)
+        return [{"id": id, "genres": ["dance"]} for id in ids]
+    monkeypatch.setattr(SpotifyAPI, "get_artists", get_artists)
+
+    fetching = Thread(target = SpotifyArtists.resolve, args = (["a1"],))
+    fetching.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    spotify_track("2", "a2")
+    assert time.perf_counter() - start < 0.2
+    assert SpotifyArtists.get_genres(["a1"]) == {"a1": ["dance"]}
+    fetching.join()
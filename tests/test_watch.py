@@ -0,0 +1,23 @@
+import time
+from threading import Thread
+
+import pytest
+
+from music_tagger.watch import Watcher
+
+@pytest.mark.parametrize("poll", [True, False])
+def test_uppercase_extensions_are_watched(tmp_path, poll):
+    (tmp_path / "Before.MP3").write_bytes(b"audio")
+    (tmp_path / "Cover.JPG").write_bytes(b"image")
+    watcher = Watcher(tmp_path, debounce = 0, interval = 0.01, poll = poll)
+    found = []
+    def watch():
+        for path in watcher:
+            found.append(path.name)
+            if len(found) == 2: return
+    thread = Thread(target = watch, daemon = True)
+    thread.start()
+    time.sleep(0.1)
+    (tmp_path / "After.Flac").write_bytes(b"audio")
+    thread.join(5)
+    assert sorted(found) == ["After.Flac", "Before.MP3"]